@@ -10,6 +10,7 @@ discordClientID = "413407336082833418"
 dataDirectoryPath = "data"
 configFilePathBase = os.path.join(dataDirectoryPath, "config")
 cacheFilePath = os.path.join(dataDirectoryPath, "cache.json")
+cacheDatabaseFilePath = os.path.join(dataDirectoryPath, "cache.sqlite")
 logFilePath = os.path.join(dataDirectoryPath, "console.log")
 
 isUnix = sys.platform in ["linux", "darwin"]
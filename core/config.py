@@ -1,6 +1,9 @@
 from config.constants import configFilePathBase
+from typing import Any, Callable
 from utils.dict import copyDict
 from utils.logging import logger
+from utils.scheduler import scheduler
+import copy
 import json
 import models.config
 import os
@@ -11,7 +14,10 @@ config: models.config.Config = {
 	"logging": {
 		"debug": True,
 		"writeToFile": False,
+		"maxFileSize": 10,
+		"backupCount": 3,
 	},
+	"runtime": "threaded",
 	"display": {
 		"hideTotalTime": False,
 		"progressMode": "bar",
@@ -24,9 +30,21 @@ config: models.config.Config = {
 			"maxSize": 256
 		},
 		"buttons": [],
+		"formats": {},
+	},
+	"cache": {
+		"backend": "json",
+		"maxEntries": 0,
+		"ttlDays": 0,
+	},
+	"metrics": {
+		"enabled": False,
+		"host": "127.0.0.1",
+		"port": 9595,
 	},
 	"users": [],
 }
+defaultConfig = copy.deepcopy(config)
 supportedConfigFileExtensions = {
 	"yaml": "yaml",
 	"yml": "yaml",
@@ -35,6 +53,21 @@ supportedConfigFileExtensions = {
 configFileExtension = ""
 configFileType = ""
 configFilePath = ""
+configFileModifiedAt = 0
+configWatchInterval = 5
+
+def readConfigFile() -> Any:
+	with open(configFilePath, "r", encoding = "UTF-8") as configFile:
+		if configFileType == "yaml":
+			return yaml.safe_load(configFile) or {}
+		else:
+			return json.load(configFile) or {}
+
+def getConfigFileModifiedAt() -> int:
+	try:
+		return os.stat(configFilePath).st_mtime_ns
+	except OSError:
+		return 0
 
 def loadConfig() -> None:
 	global configFileExtension, configFileType, configFilePath
@@ -50,11 +83,7 @@ def loadConfig() -> None:
 				break
 	if doesFileExist:
 		try:
-			with open(configFilePath, "r", encoding = "UTF-8") as configFile:
-				if configFileType == "yaml":
-					loadedConfig = yaml.safe_load(configFile) or {}
-				else:
-					loadedConfig = json.load(configFile) or {}
+			loadedConfig = readConfigFile()
 		except:
 			os.rename(configFilePath, f"{configFilePathBase}-{time.time():.0f}.{configFileExtension}")
 			logger.exception("Failed to parse the config file. A new one will be created.")
@@ -67,6 +96,7 @@ class YamlSafeDumper(yaml.SafeDumper):
         return super().increase_indent(flow, False)
 
 def saveConfig() -> None:
+	global configFileModifiedAt
 	try:
 		with open(configFilePath, "w", encoding = "UTF-8") as configFile:
 			if configFileType == "yaml":
@@ -76,3 +106,53 @@ def saveConfig() -> None:
 				configFile.write("\n")
 	except:
 		logger.exception("Failed to write to the config file")
+	configFileModifiedAt = getConfigFileModifiedAt()
+
+def validateConfig(loadedConfig: Any) -> str:
+	if not isinstance(loadedConfig, dict):
+		return "the file does not contain a mapping"
+	if "users" not in loadedConfig:
+		return "'users' is missing"
+	users = loadedConfig["users"]
+	if not isinstance(users, list):
+		return "'users' is not a list"
+	for user in users:
+		if not isinstance(user, dict) or not isinstance(user.get("token"), str) or not isinstance(user.get("servers"), list):
+			return "every user needs a 'token' and a list of 'servers'"
+		for server in user["servers"]:
+			if not isinstance(server, dict) or not isinstance(server.get("name"), str):
+				return "every server needs a 'name'"
+	return ""
+
+def reloadConfig() -> bool:
+	try:
+		loadedConfig = readConfigFile()
+	except Exception as e:
+		logger.error("Failed to parse the config file, keeping the current configuration: %s", e)
+		return False
+	if not loadedConfig:
+		logger.warning("The config file is empty, keeping the current configuration")
+		return False
+	configError = validateConfig(loadedConfig)
+	if configError:
+		logger.error("Invalid config file, keeping the current configuration: %s", configError)
+		return False
+	newConfig = copy.deepcopy(defaultConfig)
+	copyDict(loadedConfig, newConfig)
+	for key, value in newConfig.items():
+		config[key] = value
+	return True
+
+def watchConfig(callback: Callable[[], None]) -> None:
+	def checkConfigFile() -> None:
+		global configFileModifiedAt
+		try:
+			modifiedAt = getConfigFileModifiedAt()
+			if modifiedAt and modifiedAt != configFileModifiedAt:
+				configFileModifiedAt = modifiedAt
+				logger.info("Config file changed, reloading it")
+				if reloadConfig():
+					callback()
+		finally:
+			scheduler.schedule(configWatchInterval, checkConfigFile)
+	scheduler.schedule(configWatchInterval, checkConfigFile)
@@ -1,62 +1,275 @@
 from config.constants import discordClientID, isUnix, processID, ipcPipeBase
-from typing import Any, Optional
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import Any, Coroutine, Optional, TypeVar
+from utils.cache import getCacheKey, setCacheKey
+from utils.inotify import DirectoryWatcher, isInotifySupported
 from utils.logging import logger
+from utils.metrics import incrementCounter, observeHistogram
 import asyncio
+import copy
+import itertools
 import json
 import models.discord
 import os
 import struct
+import threading
 import time
+import uuid
+
+T = TypeVar("T")
+
+class IpcOpcode(IntEnum):
+	HANDSHAKE = 0
+	FRAME = 1
+	CLOSE = 2
+	PING = 3
+	PONG = 4
+
+class IpcFrameDecoder:
+
+	headerSize = 8
+	maximumPayloadSize = 16 * 1024 * 1024
+
+	def __init__(self) -> None:
+		self.buffer = bytearray()
+
+	def feed(self, data: bytes) -> list[tuple[int, Any]]:
+		self.buffer += data
+		frames: list[tuple[int, Any]] = []
+		position = 0
+		while len(self.buffer) - position >= self.headerSize:
+			op, length = struct.unpack_from("<ii", self.buffer, position)
+			if length < 0 or length > self.maximumPayloadSize:
+				raise ValueError(f"Invalid IPC frame length: {length}")
+			payloadStart = position + self.headerSize
+			if len(self.buffer) < payloadStart + length:
+				break
+			frames.append((op, json.loads(self.buffer[payloadStart:payloadStart + length].decode("utf-8"))))
+			position = payloadStart + length
+		if position:
+			del self.buffer[:position]
+		return frames
 
 class DiscordIpcService:
 
-	def __init__(self, pipeNumber: Optional[int]):
+	readChunkSize = 65536
+	requestTimeout = 10
+	activityRateLimit = 5
+	activityRatePeriod = 20
+	activityTimestampTolerance = 2000
+	pipeAppearanceDelay = 1
+	pipePollInterval = 5
+
+	def __init__(self, pipeNumber: Optional[int], loop: Optional[asyncio.AbstractEventLoop] = None):
 		pipeNumber = pipeNumber or -1
 		pipeNumbers = range(10) if pipeNumber == -1 else [pipeNumber]
 		self.pipes: list[str] = []
-		for pipeNumber in pipeNumbers:
-			pipeFilename = f"discord-ipc-{pipeNumber}"
+		for candidatePipeNumber in pipeNumbers:
+			pipeFilename = f"discord-ipc-{candidatePipeNumber}"
 			self.pipes.append(os.path.join(ipcPipeBase, pipeFilename))
 			self.pipes.append(os.path.join(ipcPipeBase, "app", "com.discordapp.Discord", pipeFilename))
 			self.pipes.append(os.path.join(ipcPipeBase, ".flatpak", "com.discordapp.Discord", "xdg-run", pipeFilename))
-		self.loop: Optional[asyncio.AbstractEventLoop] = None
+		self.pipeCacheKey = f"discordIpcPipe:{pipeNumber}"
+		self.lastPipe: Optional[str] = None
+		self.pipeWatcher: Optional[DirectoryWatcher] = None
+		self.pipePollHandle: Optional[asyncio.TimerHandle] = None
+		self.undeliveredActivity: Optional[models.discord.Activity] = None
+		self.loop = loop
+		self.loopThread: Optional[threading.Thread] = None
+		self.loopLock = threading.Lock()
+		self.ipcLock: Optional[asyncio.Lock] = None
 		self.pipeReader: Optional[asyncio.StreamReader] = None
 		self.pipeWriter: Optional[asyncio.StreamWriter] = None
+		self.readerTask: Optional[asyncio.Task[None]] = None
+		self.readyFuture: Optional[asyncio.Future[Any]] = None
+		self.pendingRequests: dict[str, asyncio.Future[Any]] = {}
 		self.connected = False
+		self.metricLabels = { "pipe": str(pipeNumber) }
+		self.pendingActivity: Optional[models.discord.Activity] = None
+		self.pendingActivityRequestedAt: Optional[float] = None
+		self.pendingActivityWaiters: list[asyncio.Future[None]] = []
+		self.hasPendingActivity = False
+		self.lastSentActivity: Optional[models.discord.Activity] = None
+		self.activityTokens = float(self.activityRateLimit)
+		self.activityTokensUpdatedAt = time.monotonic()
+		self.activityTask: Optional[asyncio.Task[None]] = None
+
+	def startLoop(self) -> asyncio.AbstractEventLoop:
+		with self.loopLock:
+			if not self.loop:
+				self.loop = asyncio.new_event_loop()
+				self.loopThread = threading.Thread(target = self.runLoop, args = (self.loop,), name = "DiscordIpc", daemon = True)
+				self.loopThread.start()
+			return self.loop
+
+	def runLoop(self, loop: asyncio.AbstractEventLoop) -> None:
+		loop.run_forever()
+		loop.close()
+
+	def stopLoop(self) -> None:
+		with self.loopLock:
+			if self.loop and self.loopThread:
+				self.loop.call_soon_threadsafe(self.loop.stop)
+				self.loop, self.loopThread, self.ipcLock = None, None, None
+
+	def runCoroutine(self, coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+		return asyncio.run_coroutine_threadsafe(coroutine, self.startLoop())
+
+	def getIpcLock(self) -> asyncio.Lock:
+		if not self.ipcLock:
+			self.ipcLock = asyncio.Lock()
+		return self.ipcLock
+
+	def getCandidatePipes(self) -> list[str]:
+		if self.lastPipe is None:
+			cachedPipe = getCacheKey(self.pipeCacheKey)
+			self.lastPipe = cachedPipe if isinstance(cachedPipe, str) else ""
+		pipes = self.pipes
+		if self.lastPipe in pipes:
+			pipes = [self.lastPipe] + [pipe for pipe in pipes if pipe != self.lastPipe]
+		if not isUnix:
+			return pipes
+		directoryEntries: dict[str, set[str]] = {}
+		for directoryPath in { os.path.dirname(pipe) for pipe in pipes }:
+			try:
+				directoryEntries[directoryPath] = set(os.listdir(directoryPath))
+			except OSError:
+				directoryEntries[directoryPath] = set()
+		return [pipe for pipe in pipes if os.path.basename(pipe) in directoryEntries[os.path.dirname(pipe)]]
 
 	async def handshake(self) -> None:
 		if not self.loop:
 			return
-		for pipe in self.pipes:
+		for pipe in self.getCandidatePipes():
 			try:
 				if isUnix:
 					self.pipeReader, self.pipeWriter = await asyncio.open_unix_connection(pipe) # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType]
 				else:
 					self.pipeReader = asyncio.StreamReader()
 					self.pipeWriter = (await self.loop.create_pipe_connection(lambda: asyncio.StreamReaderProtocol(self.pipeReader), pipe))[0] # pyright: ignore[reportAttributeAccessIssue,reportUnknownMemberType,reportArgumentType]
-				self.write(0, { "v": 1, "client_id": discordClientID })
-				if await self.read():
+				self.readyFuture = self.loop.create_future()
+				self.readerTask = self.loop.create_task(self.readLoop(self.pipeReader))
+				self.write(IpcOpcode.HANDSHAKE, { "v": 1, "client_id": discordClientID })
+				if await asyncio.wait_for(self.readyFuture, self.requestTimeout):
 					self.connected = True
+					self.lastSentActivity = None
 					logger.info(f"Connected to Discord IPC pipe {pipe}")
+					if pipe != self.lastPipe:
+						self.lastPipe = pipe
+						setCacheKey(self.pipeCacheKey, pipe)
+					self.stopWatchingPipes()
 					break
 			except FileNotFoundError:
 				pass
 			except:
 				logger.exception(f"An unexpected error occured while connecting to Discord IPC pipe {pipe}")
+			await self.closePipe()
 		if not self.connected:
-			logger.error(f"Discord IPC pipe not found (attempted pipes: {', '.join(self.pipes)})")
+			logger.error("Discord IPC pipe not found")
+			logger.debug("Candidate Discord IPC pipes: %s", ", ".join(self.pipes))
 
-	async def read(self) -> Optional[Any]:
-		if not self.pipeReader:
+	def watchPipes(self) -> None:
+		if not self.loop or not isUnix or self.pipeWatcher or self.pipePollHandle:
 			return
+		if isInotifySupported:
+			try:
+				self.pipeWatcher = DirectoryWatcher([directoryPath for directoryPath in { os.path.dirname(pipe) for pipe in self.pipes } if os.path.isdir(directoryPath)])
+				self.loop.add_reader(self.pipeWatcher.fd, self.handlePipeWatcherEvent)
+				logger.debug("Waiting for a Discord IPC pipe to be created")
+				return
+			except OSError:
+				logger.exception("An unexpected error occured while watching for Discord IPC pipes")
+				self.pipeWatcher = None
+		self.pipePollHandle = self.loop.call_later(self.pipePollInterval, self.pollPipes)
+
+	def stopWatchingPipes(self) -> None:
+		if self.pipeWatcher:
+			if self.loop:
+				self.loop.remove_reader(self.pipeWatcher.fd)
+			self.pipeWatcher.close()
+			self.pipeWatcher = None
+		if self.pipePollHandle:
+			self.pipePollHandle.cancel()
+			self.pipePollHandle = None
+
+	def handlePipeWatcherEvent(self) -> None:
+		assert self.pipeWatcher and self.loop
+		if any(os.path.basename(path).startswith("discord-ipc-") for path in self.pipeWatcher.readCreatedPaths()):
+			self.stopWatchingPipes()
+			self.loop.call_later(self.pipeAppearanceDelay, self.deliverActivity)
+
+	def pollPipes(self) -> None:
+		self.pipePollHandle = None
+		if self.getCandidatePipes():
+			self.deliverActivity()
+		else:
+			self.watchPipes()
+
+	def deliverActivity(self) -> None:
+		assert self.loop
+		if self.undeliveredActivity and not self.connected:
+			logger.info("Discord IPC pipe found, updating activity")
+			self.loop.create_task(self.queueActivity(self.undeliveredActivity))
+
+	async def readLoop(self, pipeReader: asyncio.StreamReader) -> None:
+		frameDecoder = IpcFrameDecoder()
 		try:
-			dataBytes = await self.pipeReader.read(1024)
-			data = json.loads(dataBytes[8:].decode("utf-8"))
-			logger.debug("[READ] %s", data)
-			return data
-		except:
+			while dataBytes := await pipeReader.read(self.readChunkSize):
+				for op, payload in frameDecoder.feed(dataBytes):
+					self.handleFrame(op, payload)
+		except Exception:
 			logger.exception("An unexpected error occured during an IPC read operation")
+		if self.pipeReader is pipeReader:
 			self.connected = False
+			self.failPendingRequests(ConnectionError("Discord IPC pipe closed"))
+
+	def handleFrame(self, op: int, payload: Any) -> None:
+		logger.debug("[READ] %s", payload)
+		if op == IpcOpcode.PING:
+			self.write(IpcOpcode.PONG, payload)
+		elif op == IpcOpcode.CLOSE:
+			logger.warning("Discord IPC pipe closed by Discord: %s", payload)
+			self.connected = False
+			self.failPendingRequests(ConnectionError("Discord IPC pipe closed by Discord"))
+		elif op == IpcOpcode.FRAME:
+			if payload.get("evt") == "READY":
+				if self.readyFuture and not self.readyFuture.done():
+					self.readyFuture.set_result(payload)
+				return
+			future = self.pendingRequests.pop(payload.get("nonce") or "", None)
+			if future and not future.done():
+				future.set_result(payload)
+
+	def failPendingRequests(self, exception: Exception) -> None:
+		futures = list(self.pendingRequests.values())
+		if self.readyFuture:
+			futures.append(self.readyFuture)
+		self.pendingRequests.clear()
+		for future in futures:
+			if not future.done():
+				future.set_exception(exception)
+
+	async def request(self, command: str, args: Any) -> Optional[Any]:
+		if not self.loop:
+			return
+		nonce = str(uuid.uuid4())
+		future: asyncio.Future[Any] = self.loop.create_future()
+		self.pendingRequests[nonce] = future
+		requestStartedAt = time.perf_counter()
+		self.write(IpcOpcode.FRAME, { "cmd": command, "args": args, "nonce": nonce })
+		try:
+			response = await asyncio.wait_for(future, self.requestTimeout)
+			observeHistogram("discord_ipc_request_duration_seconds", time.perf_counter() - requestStartedAt, { **self.metricLabels, "command": command })
+		except:
+			logger.exception("An unexpected error occured while waiting for a response to an IPC %s request", command)
+			await self.closePipe()
+			return
+		finally:
+			self.pendingRequests.pop(nonce, None)
+		if response.get("evt") == "ERROR":
+			logger.warning("Discord IPC %s request failed: %s", command, response.get("data"))
+		return response
 
 	def write(self, op: int, payload: Any) -> None:
 		if not self.pipeWriter:
@@ -69,49 +282,216 @@ class DiscordIpcService:
 			logger.exception("An unexpected error occured during an IPC write operation")
 			self.connected = False
 
+	async def closePipe(self) -> None:
+		self.connected = False
+		pipeWriter, readerTask = self.pipeWriter, self.readerTask
+		self.pipeReader, self.pipeWriter, self.readerTask = None, None, None
+		self.failPendingRequests(ConnectionError("Discord IPC pipe closed"))
+		self.readyFuture = None
+		if pipeWriter:
+			try:
+				pipeWriter.close()
+			except:
+				logger.exception("An unexpected error occured while closing the IPC pipe writer")
+		if readerTask:
+			readerTask.cancel()
+			try:
+				await readerTask
+			except:
+				pass
+
+	async def connectAsync(self) -> None:
+		async with self.getIpcLock():
+			if self.connected:
+				return
+			logger.info("Connecting to Discord IPC pipe")
+			await self.handshake()
+
+	async def disconnectAsync(self) -> None:
+		async with self.getIpcLock():
+			self.undeliveredActivity = None
+			self.stopWatchingPipes()
+			if not self.connected:
+				return
+			logger.info("Disconnecting from Discord IPC pipe")
+			await self.closePipe()
+
+	def isSameActivity(self, activity: Optional[models.discord.Activity], otherActivity: Optional[models.discord.Activity]) -> bool:
+		if activity is None or otherActivity is None:
+			return activity is otherActivity
+		if { key: value for key, value in activity.items() if key != "timestamps" } != { key: value for key, value in otherActivity.items() if key != "timestamps" }:
+			return False
+		timestamps, otherTimestamps = activity.get("timestamps", {}), otherActivity.get("timestamps", {})
+		if timestamps.keys() != otherTimestamps.keys():
+			return False
+		return all(abs(timestamps[key] - otherTimestamps[key]) <= self.activityTimestampTolerance for key in timestamps) # pyright: ignore[reportTypedDictNotRequiredAccess]
+
+	async def waitForActivityToken(self) -> None:
+		while True:
+			currentTime = time.monotonic()
+			self.activityTokens = min(float(self.activityRateLimit), self.activityTokens + (currentTime - self.activityTokensUpdatedAt) * self.activityRateLimit / self.activityRatePeriod)
+			self.activityTokensUpdatedAt = currentTime
+			if self.activityTokens >= 1:
+				self.activityTokens -= 1
+				return
+			await asyncio.sleep((1 - self.activityTokens) * self.activityRatePeriod / self.activityRateLimit)
+
+	async def queueActivity(self, activity: Optional[models.discord.Activity], requestedAt: Optional[float] = None) -> None:
+		assert self.loop
+		if self.hasPendingActivity:
+			incrementCounter("discord_activity_updates_coalesced_total", labels = self.metricLabels)
+		self.pendingActivity, self.pendingActivityRequestedAt, self.hasPendingActivity = copy.deepcopy(activity), requestedAt, True
+		waiter: asyncio.Future[None] = self.loop.create_future()
+		self.pendingActivityWaiters.append(waiter)
+		if not self.activityTask or self.activityTask.done():
+			self.activityTask = self.loop.create_task(self.processActivityQueue())
+		await waiter
+
+	async def processActivityQueue(self) -> None:
+		while self.hasPendingActivity:
+			if not self.connected or not self.isSameActivity(self.pendingActivity, self.lastSentActivity):
+				await self.waitForActivityToken()
+			activity, requestedAt, waiters = self.pendingActivity, self.pendingActivityRequestedAt, self.pendingActivityWaiters
+			self.pendingActivityWaiters, self.hasPendingActivity = [], False
+			try:
+				if self.connected and self.isSameActivity(activity, self.lastSentActivity):
+					logger.debug("Activity unchanged, skipping update")
+					incrementCounter("discord_activity_updates_skipped_total", labels = self.metricLabels)
+				elif await self.sendActivity(activity, requestedAt):
+					incrementCounter("discord_activity_updates_sent_total", labels = self.metricLabels)
+			except:
+				logger.exception("An unexpected error occured while updating the activity")
+			for waiter in waiters:
+				if not waiter.done():
+					waiter.set_result(None)
+
+	async def sendActivity(self, activity: Optional[models.discord.Activity], requestedAt: Optional[float] = None) -> bool:
+		async with self.getIpcLock():
+			if not self.connected:
+				self.undeliveredActivity = activity
+				if not activity:
+					return False
+				await self.closePipe()
+				logger.info("Connecting to Discord IPC pipe")
+				await self.handshake()
+				if not self.connected:
+					self.watchPipes()
+					return False
+				self.undeliveredActivity = None
+			if activity:
+				logger.info("Activity update: %s", activity)
+			else:
+				logger.info("Clearing activity")
+			if not await self.request("SET_ACTIVITY", { "pid": processID, "activity": activity }):
+				return False
+			self.lastSentActivity = activity
+			if requestedAt is not None:
+				logger.debug("Activity written %.1f ms after it was requested", (time.perf_counter() - requestedAt) * 1000)
+				observeHistogram("discord_activity_latency_seconds", time.perf_counter() - requestedAt, self.metricLabels)
+			return True
+
 	def connect(self) -> None:
 		if self.connected:
 			logger.warning("Attempt to connect to Discord IPC pipe while already connected")
 			return
-		logger.info("Connecting to Discord IPC pipe")
-		self.loop = asyncio.new_event_loop()
-		self.loop.run_until_complete(self.handshake())
+		self.runCoroutine(self.connectAsync()).result()
 
 	def disconnect(self) -> None:
 		if not self.connected:
 			logger.warning("Attempt to disconnect from Discord IPC pipe while not connected")
 			return
-		if not self.loop or not self.pipeWriter or not self.pipeReader:
-			return
-		logger.info("Disconnecting from Discord IPC pipe")
-		try:
-			self.pipeWriter.close()
-		except:
-			logger.exception("An unexpected error occured while closing the IPC pipe writer")
-		try:
-			self.loop.run_until_complete(self.pipeReader.read())
-		except:
-			logger.exception("An unexpected error occured while closing the IPC pipe reader")
-		try:
-			self.loop.close()
-		except:
-			logger.exception("An unexpected error occured while closing the asyncio event loop")
-		self.connected = False
+		self.runCoroutine(self.disconnectAsync()).result()
 
-	def setActivity(self, activity: models.discord.Activity) -> None:
-		if not self.connected:
-			logger.warning("Attempt to set activity while not connected to Discord IPC pipe")
-			return
-		if not self.loop:
-			return
-		logger.info("Activity update: %s", activity)
-		payload = {
-			"cmd": "SET_ACTIVITY",
-			"args": {
-				"pid": processID,
-				"activity": activity,
-			},
-			"nonce": "{0:.2f}".format(time.time()),
-		}
-		self.write(1, payload)
-		self.loop.run_until_complete(self.read())
+	def setActivity(self, activity: models.discord.Activity, requestedAt: Optional[float] = None) -> Future[None]:
+		return self.runCoroutine(self.queueActivity(activity, requestedAt))
+
+	def clearActivity(self) -> Future[None]:
+		return self.runCoroutine(self.queueActivity(None))
+
+class DiscordIpcClient:
+
+	def __init__(self, manager: "DiscordIpcManager", service: DiscordIpcService, name: str, priority: int) -> None:
+		self.manager = manager
+		self.service = service
+		self.name = name
+		self.priority = priority
+		self.activity: Optional[models.discord.Activity] = None
+		self.updatedAt = 0
+
+	def setActivity(self, activity: models.discord.Activity, requestedAt: Optional[float] = None) -> Future[None]:
+		return self.manager.updateClient(self, activity, requestedAt)
+
+	def refreshActivity(self, activity: models.discord.Activity, requestedAt: Optional[float] = None) -> Future[None]:
+		return self.manager.updateClient(self, activity, requestedAt, True)
+
+	def clearActivity(self) -> Future[None]:
+		return self.manager.updateClient(self, None)
+
+	def release(self) -> Future[None]:
+		return self.manager.releaseClient(self)
+
+class DiscordIpcManager:
+
+	def __init__(self) -> None:
+		self.services: dict[int, DiscordIpcService] = {}
+		self.clients: dict[DiscordIpcService, list[DiscordIpcClient]] = {}
+		self.displayedClients: dict[DiscordIpcService, Optional[DiscordIpcClient]] = {}
+		self.sequence = itertools.count(1)
+		self.lock = threading.Lock()
+
+	def createClient(self, name: str, pipeNumber: Optional[int], priority: int = 0, loop: Optional[asyncio.AbstractEventLoop] = None) -> DiscordIpcClient:
+		pipeNumber = pipeNumber or -1
+		with self.lock:
+			service = self.services.get(pipeNumber)
+			if not service:
+				service = self.services[pipeNumber] = DiscordIpcService(pipeNumber, loop)
+				self.clients[service], self.displayedClients[service] = [], None
+			client = DiscordIpcClient(self, service, name, priority)
+			self.clients[service].append(client)
+			return client
+
+	def selectClient(self, service: DiscordIpcService) -> Optional[DiscordIpcClient]:
+		return max((client for client in self.clients[service] if client.activity), key = lambda client: (client.priority, client.updatedAt), default = None)
+
+	def updateDisplayedActivity(self, service: DiscordIpcService, updatedClient: DiscordIpcClient, requestedAt: Optional[float] = None) -> Future[None]:
+		selectedClient = self.selectClient(service)
+		if selectedClient is self.displayedClients[service] and selectedClient is not updatedClient:
+			if selectedClient and updatedClient.activity:
+				logger.debug("Activity of '%s' is hidden by the activity of '%s'", updatedClient.name, selectedClient.name)
+			future: Future[None] = Future()
+			future.set_result(None)
+			return future
+		self.displayedClients[service] = selectedClient
+		if selectedClient and selectedClient.activity:
+			return service.setActivity(selectedClient.activity, requestedAt if selectedClient is updatedClient else None)
+		return service.clearActivity()
+
+	def updateClient(self, client: DiscordIpcClient, activity: Optional[models.discord.Activity], requestedAt: Optional[float] = None, isRefresh: bool = False) -> Future[None]:
+		with self.lock:
+			if client not in self.clients.get(client.service, []):
+				future: Future[None] = Future()
+				future.set_result(None)
+				return future
+			client.activity = activity
+			if activity and not isRefresh:
+				client.updatedAt = next(self.sequence)
+			return self.updateDisplayedActivity(client.service, client, requestedAt)
+
+	def releaseClient(self, client: DiscordIpcClient) -> Future[None]:
+		with self.lock:
+			service = client.service
+			if client not in self.clients.get(service, []):
+				future: Future[None] = Future()
+				future.set_result(None)
+				return future
+			self.clients[service].remove(client)
+			client.activity = None
+			if self.clients[service]:
+				return self.updateDisplayedActivity(service, client)
+			del self.clients[service], self.displayedClients[service]
+			self.services = { pipeNumber: otherService for pipeNumber, otherService in self.services.items() if otherService is not service }
+			future = service.runCoroutine(service.disconnectAsync())
+			future.add_done_callback(lambda _: service.stopLoop())
+			return future
+
+discordIpcManager = DiscordIpcManager()
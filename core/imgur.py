@@ -2,30 +2,53 @@ from .config import config
 from PIL import Image
 from PIL import ImageOps
 from typing import Optional
+from utils.cache import getCacheKey, setCacheKey
 from utils.logging import logger
+from utils.metrics import getRatio, incrementCounter, observeHistogram
+import hashlib
 import io
 import models.imgur
 import requests
+import time
+
+def processImage(imageBytes: bytes, maxSize: int = 0, padPoster: bool = False) -> bytes:
+	originalImage = Image.open(io.BytesIO(imageBytes))
+	if maxSize:
+		originalImage.draft("RGB", (maxSize, maxSize))
+	newImage = originalImage.convert("RGBA")
+	if maxSize:
+		newImage.thumbnail((maxSize, maxSize), reducing_gap = 3.0)
+	if padPoster:
+		newImage = ImageOps.pad(newImage, (maxSize, maxSize), color=(255,255,255,0))
+	newImageBytesIO = io.BytesIO()
+	newImage.save(newImageBytesIO, subsampling = 0, quality = 90, format = "PNG")
+	return newImageBytesIO.getvalue()
+
+def getImageHashCacheKey(imageBytes: bytes) -> str:
+	return f"imageHash:{hashlib.sha256(imageBytes).hexdigest()}"
 
 def uploadToImgur(url: str, maxSize: int = 0, padPoster: bool = False) -> Optional[str]:
 	try:
-		originalImageBytesIO = io.BytesIO(requests.get(url).content)
-		originalImage = Image.open(originalImageBytesIO)
-		newImage = Image.new("RGBA", originalImage.size)
-		newImage.putdata(originalImage.getdata()) # pyright: ignore[reportUnknownMemberType,reportUnknownArgumentType]
-		if maxSize:
-			newImage.thumbnail((maxSize, maxSize))
-		newImageBytesIO = io.BytesIO()
-		if padPoster:
-			newImage = ImageOps.pad(newImage, (maxSize, maxSize), color=(255,255,255,0))
-		newImage.save(newImageBytesIO, subsampling = 0, quality = 90, format = "PNG")
+		response = requests.get(url)
+		response.raise_for_status()
+		imageBytes = processImage(response.content, maxSize, padPoster)
+		imageHashCacheKey = getImageHashCacheKey(imageBytes)
+		link = getCacheKey(imageHashCacheKey)
+		if link and isinstance(link, str):
+			incrementCounter("image_hash_cache_hits_total")
+			logger.debug("Found an identical image in the cache (hit ratio: %.1f%%)", getRatio("image_hash_cache_hits_total", "image_hash_cache_misses_total") * 100)
+			return link
+		incrementCounter("image_hash_cache_misses_total")
+		uploadStartedAt = time.perf_counter()
 		data: models.imgur.UploadResponse = requests.post(
 			"https://api.imgur.com/3/image",
 			headers = { "Authorization": f"Client-ID {config['display']['posters']['imgurClientID']}" },
-			files = { "image": newImageBytesIO.getvalue() }
+			files = { "image": imageBytes }
 		).json()
+		observeHistogram("imgur_upload_duration_seconds", time.perf_counter() - uploadStartedAt)
 		if not data["success"]:
 			raise Exception(data["data"]["error"])
+		setCacheKey(imageHashCacheKey, data["data"]["link"])
 		return data["data"]["link"]
 	except:
 		logger.exception("An unexpected error occured while uploading an image to Imgur")
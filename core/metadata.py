@@ -0,0 +1,71 @@
+# pyright: reportUnknownArgumentType=none,reportUnknownMemberType=none,reportUnknownVariableType=none
+
+from collections import OrderedDict
+from plexapi.base import PlexPartialObject
+from plexapi.media import Guid
+from plexapi.server import PlexServer
+from typing import Any, Callable, Hashable
+from utils.metrics import incrementCounter
+import threading
+import time
+
+class MetadataCache:
+
+	ttl = 3600
+	maxEntries = 256
+
+	def __init__(self, server: PlexServer, serverName: str) -> None:
+		self.server = server
+		self.labels = { "server": serverName }
+		self.entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+		currentTime = time.monotonic()
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry and entry[1] > currentTime:
+				self.entries.move_to_end(key)
+				incrementCounter("metadata_cache_hits_total", labels = self.labels)
+				return entry[0]
+		incrementCounter("metadata_cache_misses_total", labels = self.labels)
+		value = fetch()
+		with self.lock:
+			self.entries[key] = (value, currentTime + self.ttl)
+			self.entries.move_to_end(key)
+			self.evict(currentTime)
+		return value
+
+	def evict(self, currentTime: float) -> None:
+		for key in [key for key, (_, expiresAt) in self.entries.items() if expiresAt <= currentTime]:
+			del self.entries[key]
+		while len(self.entries) > self.maxEntries:
+			self.entries.popitem(last = False)
+
+	def contains(self, ratingKey: int) -> bool:
+		with self.lock:
+			entry = self.entries.get(("item", ratingKey))
+			return bool(entry and entry[1] > time.monotonic())
+
+	def fetchItem(self, ratingKey: int) -> PlexPartialObject:
+		def fetch() -> PlexPartialObject:
+			incrementCounter("plex_requests_total", labels = { **self.labels, "endpoint": "fetchItem" })
+			return self.server.fetchItem(ratingKey)
+		return self.get(("item", ratingKey), fetch)
+
+	def fetchLibraryName(self, item: PlexPartialObject) -> str:
+		def fetch() -> str:
+			incrementCounter("plex_requests_total", labels = { **self.labels, "endpoint": "section" })
+			return item.section().title
+		return self.get(("section", item.librarySectionID), fetch)
+
+	def fetchGuids(self, ratingKey: int) -> list[Guid]:
+		return self.fetchItem(ratingKey).guids
+
+	def invalidate(self, ratingKey: int) -> None:
+		with self.lock:
+			self.entries.pop(("item", ratingKey), None)
+
+	def clear(self) -> None:
+		with self.lock:
+			self.entries.clear()
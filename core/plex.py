@@ -1,24 +1,31 @@
 # pyright: reportUnknownArgumentType=none,reportUnknownMemberType=none,reportUnknownVariableType=none
 
 from .config import config
-from .discord import DiscordIpcService
-from .imgur import uploadToImgur
+from .discord import discordIpcManager
+from .metadata import MetadataCache
+from .posters import requestPoster
+from .presence import getPresenceRenderer, mediaTypeActivityTypeMap
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from config.constants import name, plexClientID
 from plexapi.alert import AlertListener
 from plexapi.base import PlexSession, PlexPartialObject
 from plexapi.media import Genre, Guid
-from plexapi.myplex import MyPlexAccount, PlexServer
-from typing import Optional
-from utils.cache import getCacheKey, setCacheKey
-from utils.logging import LoggerWithPrefix
-from utils.text import formatSeconds, truncate
+from plexapi.myplex import MyPlexAccount, MyPlexResource, PlexServer
+from typing import Any, Callable, Optional
+from utils.backoff import Backoff
+from utils.cache import getCacheKey, setCacheKey, flushCache
+from utils.logging import LoggerWithPrefix, logger
+from utils.metrics import getRatio, incrementCounter
+from utils.scheduler import ScheduledTask, scheduler
 import models.config
 import models.discord
 import models.plex
+import asyncio
 import requests
 import threading
 import time
 import urllib.parse
+import websocket
 
 def initiateAuth() -> tuple[str, str, str]:
 	response = requests.post("https://plex.tv/api/v2/pins.json?strong=true", headers = {
@@ -34,75 +41,275 @@ def getAuthToken(id: str, code: str) -> Optional[str]:
 	}).json()
 	return response["authToken"]
 
-mediaTypeActivityTypeMap = {
-	"movie": models.discord.ActivityType.WATCHING,
-	"episode": models.discord.ActivityType.WATCHING,
-	"live_episode": models.discord.ActivityType.WATCHING,
-	"track": models.discord.ActivityType.LISTENING,
-	"clip": models.discord.ActivityType.WATCHING,
-}
-buttonTypeGuidTypeMap = {
-	"imdb": "imdb",
-	"tmdb": "tmdb",
-	"thetvdb": "tvdb",
-	"trakt": "tmdb",
-	"letterboxd": "tmdb",
-	"musicbrainz": "mbid",
-}
+accountCacheTtl = 600
+accountCache: dict[str, tuple[MyPlexAccount, list[MyPlexResource], float]] = {}
+accountCacheLocks: dict[str, threading.Lock] = {}
+accountCacheLock = threading.Lock()
+accountBackoffs: dict[str, Backoff] = {}
+
+def getAccountBackoff(token: str) -> Backoff:
+	with accountCacheLock:
+		return accountBackoffs.setdefault(token, Backoff("plex.tv"))
+
+def getAccount(token: str, refresh: bool = False) -> tuple[MyPlexAccount, list[MyPlexResource], bool]:
+	with accountCacheLock:
+		tokenLock = accountCacheLocks.setdefault(token, threading.Lock())
+	with tokenLock:
+		cachedAccount = accountCache.get(token)
+		if cachedAccount and not refresh and cachedAccount[2] > time.monotonic():
+			return cachedAccount[0], cachedAccount[1], True
+		try:
+			account = MyPlexAccount(token = token)
+			resources: list[MyPlexResource] = account.resources()
+		except:
+			getAccountBackoff(token).recordFailure()
+			raise
+		getAccountBackoff(token).recordSuccess()
+		accountCache[token] = (account, resources, time.monotonic() + accountCacheTtl)
+		return account, resources, False
+
+connectionTimeout = 10
+cachedEndpointTimeout = 5
+connectionGracePeriod = 0.5
+
+def tryConnection(url: str, token: str, timeout: float) -> tuple[PlexServer, str, float]:
+	startTime = time.perf_counter()
+	server = PlexServer(url, token, timeout = timeout)
+	return server, url, (time.perf_counter() - startTime) * 1000
+
+def isCacheableEndpoint(url: str, relayUrls: set[str]) -> bool:
+	return url.startswith("https://") and url not in relayUrls
+
+def connectResource(resource: MyPlexResource) -> PlexServer:
+	cacheKey = f"serverEndpoint:{resource.clientIdentifier}"
+	urls: list[str] = resource.preferred_connections()
+	relayUrls = { url for connection in resource.connections if connection.relay for url in [connection.uri, connection.httpuri] }
+	cachedEndpoint = getCacheKey(cacheKey)
+	if isinstance(cachedEndpoint, dict) and cachedEndpoint.get("uri") in urls and isCacheableEndpoint(cachedEndpoint["uri"], relayUrls):
+		try:
+			server, url, latency = tryConnection(cachedEndpoint["uri"], resource.accessToken, cachedEndpointTimeout)
+			logger.debug("Connected to cached endpoint %s in %.0f ms", url, latency)
+			return server
+		except Exception as e:
+			logger.debug("Failed to connect to cached endpoint %s: %s", cachedEndpoint["uri"], e)
+			urls.remove(cachedEndpoint["uri"])
+	if not urls:
+		raise Exception("No connections available")
+	executor = ThreadPoolExecutor(max_workers = len(urls), thread_name_prefix = "PlexConnection")
+	futures = { executor.submit(tryConnection, url, resource.accessToken, connectionTimeout): i for i, url in enumerate(urls) }
+	try:
+		connections: dict[int, tuple[PlexServer, float]] = {}
+		errors: list[str] = []
+		pending = set(futures)
+		graceDeadline = 0.0
+		while pending:
+			done, pending = wait(pending, timeout = max(0, graceDeadline - time.monotonic()) if connections else None, return_when = FIRST_COMPLETED)
+			for future in done:
+				try:
+					server, url, latency = future.result()
+				except Exception as e:
+					errors.append(str(e))
+					continue
+				logger.debug("Connected to %s in %.0f ms", url, latency)
+				if not connections:
+					graceDeadline = time.monotonic() + connectionGracePeriod
+				connections[futures[future]] = (server, latency)
+			if connections and (not done or all(futures[future] > min(connections) for future in pending)):
+				break
+		if not connections:
+			raise Exception(f"Unable to connect to any of {len(urls)} connections ({'; '.join(errors)})")
+		cacheableIndexes = [i for i in connections if isCacheableEndpoint(urls[i], relayUrls)]
+		if cacheableIndexes:
+			i = min(cacheableIndexes)
+			setCacheKey(cacheKey, { "uri": urls[i], "latency": round(connections[i][1]) })
+		return connections[min(connections)][0]
+	finally:
+		executor.shutdown(wait = False, cancel_futures = True)
+
+class LivenessAlertListener(AlertListener):
+
+	pingInterval = 30
+	pingTimeout = 10
+
+	def __init__(self, server: PlexServer, callback: Callable[[models.plex.Alert], None], callbackError: Callable[[Exception], None]):
+		super().__init__(server, callback, callbackError)
+		self.lastMessageAt = time.monotonic()
+		self.stopped = False
+
+	def run(self) -> None:
+		url = self._server.url(self.key, includeToken = True).replace("http", "ws", 1)
+		self._ws = websocket.WebSocketApp(url, on_message = self.onMessage, on_pong = self.onPong, on_error = self._onError, on_close = self.onClose)
+		self._ws.run_forever(ping_interval = self.pingInterval, ping_timeout = self.pingTimeout)
+
+	def stop(self) -> None:
+		self.stopped = True
+		super().stop()
+
+	def onMessage(self, *args: Any) -> None:
+		self.lastMessageAt = time.monotonic()
+		self._onMessage(*args)
+
+	def onPong(self, *args: Any) -> None:
+		self.lastMessageAt = time.monotonic()
+
+	def onClose(self, *args: Any) -> None:
+		if not self.stopped and self._callbackError:
+			self._callbackError(ConnectionError("WebSocket connection closed"))
 
 class PlexAlertListener(threading.Thread):
 
 	productName = "Plex Media Server"
 	updateTimeoutTimerInterval = 30
 	connectionCheckTimerInterval = 60
+	connectionSilenceThreshold = 90
+	minimumConnectionDuration = 60
+	lastServerTimeout = 5
 	maximumIgnores = 2
 
-	def __init__(self, token: str, serverConfig: models.config.Server):
+	def __init__(self, token: str, serverConfig: models.config.Server, loop: Optional[asyncio.AbstractEventLoop] = None):
 		super().__init__()
 		self.daemon = True
 		self.token = token
 		self.serverConfig = serverConfig
 		self.logger = LoggerWithPrefix(f"[{self.serverConfig['name']}] ") # pyright: ignore[reportTypedDictNotRequiredAccess]
-		self.discordIpcService = DiscordIpcService(self.serverConfig.get("ipcPipeNumber"))
-		self.updateTimeoutTimer: Optional[threading.Timer] = None
-		self.connectionCheckTimer: Optional[threading.Timer] = None
+		self.metricLabels = { "server": self.serverConfig["name"] } # pyright: ignore[reportTypedDictNotRequiredAccess]
+		self.discordIpcClient = discordIpcManager.createClient(self.serverConfig["name"], self.serverConfig.get("ipcPipeNumber"), self.serverConfig.get("ipcPriority", 0), loop) # pyright: ignore[reportTypedDictNotRequiredAccess]
+		self.backoff = Backoff(self.serverConfig["name"]) # pyright: ignore[reportTypedDictNotRequiredAccess]
+		self.accountBackoff = getAccountBackoff(self.token)
+		self.connectionState = "disconnected"
+		self.connectionLost = threading.Event()
+		self.stopped = threading.Event()
+		self.updateTimeoutTimer: Optional[ScheduledTask] = None
+		self.connectionCheckTimer: Optional[ScheduledTask] = None
 		self.account: Optional[MyPlexAccount] = None
 		self.server: Optional[PlexServer] = None
-		self.alertListener: Optional[AlertListener] = None
+		self.lastServerUrl, self.lastServerToken = "", ""
+		self.metadataCache: Optional[MetadataCache] = None
+		self.alertListener: Optional[LivenessAlertListener] = None
 		self.lastState, self.lastSessionKey, self.lastRatingKey = "", 0, 0
+		self.lastActivity: Optional[models.discord.Activity] = None
+		self.discordIpcLock = threading.Lock()
 		self.listenForUser, self.isServerOwner, self.ignoreCount = "", False, 0
-		self.start()
+		self.sessionUsernames: dict[int, str] = {}
+		self.setServerConfig(serverConfig)
+		if not loop:
+			self.start()
 
-	def run(self) -> None:
-		while True:
+	def setServerConfig(self, serverConfig: models.config.Server) -> None:
+		self.serverConfig = serverConfig
+		self.discordIpcClient.priority = serverConfig.get("ipcPriority", 0)
+		self.blacklistedLibraries = frozenset(serverConfig["blacklistedLibraries"]) if "blacklistedLibraries" in serverConfig else None
+		self.whitelistedLibraries = frozenset(serverConfig["whitelistedLibraries"]) if "whitelistedLibraries" in serverConfig else None
+		if self.account:
+			self.listenForUser = serverConfig.get("listenForUser", "") or self.account.username
+
+	def connectServer(self) -> None:
+		self.server = None
+		if self.lastServerUrl and self.account:
 			try:
-				self.logger.info("Signing into Plex")
-				self.account = MyPlexAccount(token = self.token)
-				self.logger.info("Signed in as Plex user '%s'", self.account.username)
+				self.logger.info("Connecting to %s '%s' at the last known address", self.productName, self.serverConfig["name"])
+				server = PlexServer(self.lastServerUrl, self.lastServerToken, timeout = self.lastServerTimeout)
+				if server.friendlyName.lower() != self.serverConfig["name"].lower():
+					raise Exception(f"Found server '{server.friendlyName}' instead")
 				self.listenForUser = self.serverConfig.get("listenForUser", "") or self.account.username
-				self.server = None
-				for resource in self.account.resources():
-					if resource.product == self.productName and resource.name.lower() == self.serverConfig["name"].lower():
-						self.logger.info("Connecting to %s '%s'", self.productName, self.serverConfig["name"])
-						self.server = resource.connect()
-						try:
-							self.server.account()
-							self.isServerOwner = True
-						except:
-							pass
-						self.logger.info("Connected to %s '%s'", self.productName, resource.name)
-						self.alertListener = AlertListener(self.server, self.tryHandleAlert, self.reconnect)
-						self.alertListener.start()
-						self.logger.info("Listening for alerts from user '%s'", self.listenForUser)
-						self.connectionCheckTimer = threading.Timer(self.connectionCheckTimerInterval, self.connectionCheck)
-						self.connectionCheckTimer.start()
-						return
-				if not self.server:
-					raise Exception("Server not found")
+				self.setServer(server)
+				return
 			except Exception as e:
-				self.logger.error("Failed to connect to %s '%s': %s", self.productName, self.serverConfig["name"], e) # pyright: ignore[reportTypedDictNotRequiredAccess]
-				self.logger.error("Reconnecting in 10 seconds")
-				time.sleep(10)
+				self.logger.info("Failed to connect to the last known address: %s", e)
+			if self.accountBackoff.getWaitTime() > 0:
+				raise Exception("Signing into Plex is paused after repeated failures")
+		self.logger.info("Signing into Plex")
+		self.account, resources, isCached = getAccount(self.token)
+		self.logger.info("Signed in as Plex user '%s'%s", self.account.username, " (cached)" if isCached else "")
+		self.listenForUser = self.serverConfig.get("listenForUser", "") or self.account.username
+		try:
+			self.discoverServer(resources)
+		except Exception as e:
+			if not isCached:
+				raise
+			self.logger.info("Failed to connect using cached server resources, refreshing them: %s", e)
+			self.account, resources, _ = getAccount(self.token, True)
+			self.discoverServer(resources)
+
+	def discoverServer(self, resources: list[MyPlexResource]) -> None:
+		for resource in resources:
+			if resource.product == self.productName and resource.name.lower() == self.serverConfig["name"].lower():
+				self.logger.info("Connecting to %s '%s'", self.productName, self.serverConfig["name"])
+				self.setServer(connectResource(resource))
+				return
+		raise Exception("Server not found")
+
+	def setServer(self, server: PlexServer) -> None:
+		self.server = server
+		self.lastServerUrl, self.lastServerToken = server._baseurl, server._token
+		self.metadataCache = MetadataCache(self.server, self.serverConfig["name"])
+		try:
+			self.server.account()
+			self.isServerOwner = True
+		except:
+			pass
+		self.logger.info("Connected to %s '%s'", self.productName, self.server.friendlyName)
+
+	def setConnectionState(self, state: str) -> None:
+		if self.connectionState == state:
+			return
+		self.logger.debug("Connection state changed from %s to %s", self.connectionState, state)
+		self.connectionState = state
+		incrementCounter("plex_connection_state_transitions_total", labels = { **self.metricLabels, "state": state })
+
+	def getWaitTime(self) -> float:
+		if self.lastServerUrl and self.account:
+			return 0
+		waitTime = self.accountBackoff.getWaitTime()
+		if waitTime > 0:
+			self.setConnectionState("backoff")
+			self.logger.error("Signing into Plex keeps failing, retrying in %d seconds", waitTime)
+		return waitTime
+
+	def connectionFailed(self, exception: Exception) -> float:
+		self.logger.error("Failed to connect to %s '%s': %s", self.productName, self.serverConfig["name"], exception) # pyright: ignore[reportTypedDictNotRequiredAccess]
+		delay = self.backoff.recordFailure()
+		self.setConnectionState("backoff")
+		self.logger.error("Reconnecting in %d seconds", delay)
+		return delay
+
+	def connectionClosed(self, connectedAt: float, lastReceivedAt: float) -> float:
+		if lastReceivedAt > connectedAt or time.monotonic() - connectedAt >= self.minimumConnectionDuration:
+			self.backoff.recordSuccess()
+			self.logger.error("Reconnecting")
+			return 0
+		delay = self.backoff.recordFailure()
+		self.setConnectionState("backoff")
+		self.logger.error("Connection to Plex closed before receiving anything, reconnecting in %d seconds", delay)
+		return delay
+
+	def run(self) -> None:
+		while not self.stopped.wait(self.getWaitTime()):
+			try:
+				self.setConnectionState("connecting")
+				self.connectServer()
+				alertListener = self.alertListener = LivenessAlertListener(self.server, self.tryHandleAlert, self.reconnect)
+				connectedAt = time.monotonic()
+				self.setConnectionState("connected")
+				alertListener.start()
+				self.logger.info("Listening for alerts from user '%s'", self.listenForUser)
+				self.connectionCheckTimer = scheduler.schedule(self.connectionCheckTimerInterval, self.connectionCheck)
+			except Exception as e:
+				if self.stopped.wait(self.connectionFailed(e)):
+					return
+				continue
+			self.connectionLost.wait()
+			self.connectionLost.clear()
+			self.disconnect()
+			if self.stopped.is_set() or self.stopped.wait(self.connectionClosed(connectedAt, alertListener.lastMessageAt)):
+				return
+
+	def stop(self) -> None:
+		self.stopped.set()
+		self.setConnectionState("disconnected")
+		self.connectionLost.set()
+		self.disconnect()
+		self.discordIpcClient.release()
 
 	def disconnect(self) -> None:
 		if self.alertListener:
@@ -114,19 +321,25 @@ class PlexAlertListener(threading.Thread):
 		if self.connectionCheckTimer:
 			self.connectionCheckTimer.cancel()
 			self.connectionCheckTimer = None
-		self.account, self.server, self.alertListener, self.listenForUser, self.isServerOwner, self.ignoreCount = None, None, None, "", False, 0
+		self.server, self.metadataCache, self.alertListener, self.listenForUser, self.isServerOwner, self.ignoreCount = None, None, None, "", False, 0
+		self.sessionUsernames = {}
+		flushCache()
 		self.logger.info("Stopped listening for alerts")
 
 	def reconnect(self, exception: Exception) -> None:
+		if self.connectionState != "connected":
+			return
 		self.logger.error("Connection to Plex lost: %s", exception)
-		self.disconnect()
-		self.logger.error("Reconnecting")
-		self.run()
+		incrementCounter("plex_reconnects_total", labels = self.metricLabels)
+		self.setConnectionState("disconnected")
+		self.connectionLost.set()
 
 	def disconnectRpc(self) -> None:
 		self.lastState, self.lastSessionKey, self.lastRatingKey = "", 0, 0
-		if self.discordIpcService.connected:
-			self.discordIpcService.disconnect()
+		with self.discordIpcLock:
+			if self.lastActivity:
+				self.discordIpcClient.clearActivity()
+			self.lastActivity = None
 		if self.updateTimeoutTimer:
 			self.updateTimeoutTimer.cancel()
 			self.updateTimeoutTimer = None
@@ -136,14 +349,17 @@ class PlexAlertListener(threading.Thread):
 		self.disconnectRpc()
 
 	def connectionCheck(self) -> None:
-		try:
-			self.logger.debug("Running periodic connection check")
-			self.server.clients()
-		except Exception as e:
-			self.reconnect(e)
-		else:
-			self.connectionCheckTimer = threading.Timer(self.connectionCheckTimerInterval, self.connectionCheck)
-			self.connectionCheckTimer.start()
+		alertListener = self.alertListener
+		if not alertListener:
+			return
+		if not alertListener.is_alive():
+			self.reconnect(ConnectionError("WebSocket thread stopped"))
+			return
+		silentFor = time.monotonic() - alertListener.lastMessageAt
+		if silentFor > self.connectionSilenceThreshold:
+			self.reconnect(ConnectionError(f"No WebSocket traffic or pongs for {silentFor:.0f} seconds"))
+			return
+		self.connectionCheckTimer = scheduler.schedule(self.connectionCheckTimerInterval, self.connectionCheck)
 
 	def tryHandleAlert(self, alert: models.plex.Alert) -> None:
 		try:
@@ -152,23 +368,106 @@ class PlexAlertListener(threading.Thread):
 			self.logger.exception("An unexpected error occured in the Plex alert handler")
 			self.disconnectRpc()
 
-	def uploadToImgur(self, thumb: str, maxSize, padPoster) -> Optional[str]:
+	def getPosterUrl(self, thumb: str) -> tuple[str, Optional[Future[Optional[str]]]]:
 		thumbUrl = getCacheKey(thumb)
-		if not thumbUrl or not isinstance(thumbUrl, str):
-			self.logger.debug("Uploading image to Imgur")
-			thumbUrl = uploadToImgur(self.server.url(thumb, True), maxSize, padPoster)
-			setCacheKey(thumb, thumbUrl)
-		return thumbUrl
+		if thumbUrl and isinstance(thumbUrl, str):
+			incrementCounter("poster_cache_hits_total")
+			return thumbUrl, None
+		incrementCounter("poster_cache_misses_total")
+		self.logger.debug("Uploading image to Imgur (poster cache hit ratio: %.1f%%)", getRatio("poster_cache_hits_total", "poster_cache_misses_total") * 100)
+		maxSize = config["display"]["posters"]["maxSize"]
+		if maxSize:
+			url = self.server.transcodeImage(thumb, maxSize, maxSize, minSize = False, upscale = False, imageFormat = "png")
+		else:
+			url = self.server.url(thumb, True)
+		return "", requestPoster(thumb, url, maxSize, config["display"]["posters"]["padPoster"])
 
+	def handlePosterUploaded(self, activity: models.discord.Activity, assetKey: str, future: Future[Optional[str]]) -> None:
+		thumbUrl = future.result()
+		if not thumbUrl:
+			return
+		with self.discordIpcLock:
+			if self.lastActivity is not activity:
+				return
+			currentActivity = self.discordIpcClient.activity or activity
+			self.logger.debug("Poster uploaded, updating activity")
+			self.discordIpcClient.refreshActivity({ **currentActivity, "assets": { **currentActivity["assets"], assetKey: thumbUrl } })
+
+	def handleMetadataAlert(self, alert: models.plex.Alert) -> None:
+		if not self.metadataCache:
+			return
+		if alert["type"] == "timeline":
+			for timelineEntry in alert.get("TimelineEntry", []):
+				if timelineEntry.get("identifier") == "com.plexapp.plugins.library" and "itemID" in timelineEntry:
+					self.metadataCache.invalidate(int(timelineEntry["itemID"]))
+		elif alert["type"] == "activity":
+			for activityNotification in alert.get("ActivityNotification", []):
+				if activityNotification.get("event") == "ended" and activityNotification.get("Activity", {}).get("type", "").startswith("library."):
+					self.logger.debug("Library activity ended, clearing metadata cache")
+					self.metadataCache.clear()
+
+	def getSessionUsername(self, sessionKey: int) -> Optional[str]:
+		if sessionKey in self.sessionUsernames:
+			return self.sessionUsernames[sessionKey]
+		assert self.server
+		self.logger.debug("Searching sessions for session key %s", sessionKey)
+		incrementCounter("plex_requests_total", labels = { **self.metricLabels, "endpoint": "sessions" })
+		sessions: list[PlexSession] = self.server.sessions()
+		self.sessionUsernames = {}
+		for session in sessions:
+			self.logger.debug("%s, Session Key: %s, Usernames: %s", session, session.sessionKey, session.usernames)
+			if session.usernames:
+				self.sessionUsernames[int(session.sessionKey)] = session.usernames[0]
+		return self.sessionUsernames.get(sessionKey)
+
+	def shouldIgnoreAlert(self, state: str, sessionKey: int, ratingKey: int) -> bool:
+		if self.lastSessionKey == sessionKey and self.lastRatingKey == ratingKey:
+			if self.updateTimeoutTimer:
+				self.updateTimeoutTimer.cancel()
+				self.updateTimeoutTimer = None
+			if self.lastState == state and self.ignoreCount < self.maximumIgnores:
+				self.logger.debug("Nothing changed, ignoring")
+				self.ignoreCount += 1
+				self.updateTimeoutTimer = scheduler.schedule(self.updateTimeoutTimerInterval, self.updateTimeout)
+				return True
+			self.ignoreCount = 0
+			if state == "stopped":
+				self.sessionUsernames.pop(sessionKey, None)
+				self.disconnectRpc()
+				return True
+		elif state == "stopped":
+			self.logger.debug("Received 'stopped' state alert from unknown session, ignoring")
+			self.sessionUsernames.pop(sessionKey, None)
+			return True
+		return False
+
+	def fetchGuids(self, item: PlexPartialObject, mediaType: str) -> list[Guid]:
+		assert self.metadataCache
+		if mediaType == "episode":
+			return self.metadataCache.fetchGuids(item.grandparentRatingKey)
+		return item.guids
 
 	def handleAlert(self, alert: models.plex.Alert) -> None:
+		if alert["type"] in ["timeline", "activity"]:
+			self.handleMetadataAlert(alert)
+			return
 		if alert["type"] != "playing" or "PlaySessionStateNotification" not in alert:
 			return
+		alertReceivedAt = time.perf_counter()
 		stateNotification = alert["PlaySessionStateNotification"][0]
 		self.logger.debug("Received alert: %s", stateNotification)
+		incrementCounter("alerts_received_total", labels = self.metricLabels)
+		assert self.server and self.metadataCache
+		state = stateNotification["state"]
+		sessionKey = int(stateNotification["sessionKey"])
 		ratingKey = int(stateNotification["ratingKey"])
-		assert self.server
-		item: PlexPartialObject = self.server.fetchItem(ratingKey)
+		viewOffset = int(stateNotification["viewOffset"])
+		if self.shouldIgnoreAlert(state, sessionKey, ratingKey):
+			incrementCounter("alerts_short_circuited_total", labels = self.metricLabels)
+			if not self.metadataCache.contains(ratingKey):
+				incrementCounter("plex_fetches_avoided_total", labels = self.metricLabels)
+			return
+		item: PlexPartialObject = self.metadataCache.fetchItem(ratingKey)
 		if item.key and item.key.startswith("/livetv"):
 			mediaType = "live_episode"
 		else:
@@ -176,185 +475,45 @@ class PlexAlertListener(threading.Thread):
 		if mediaType not in mediaTypeActivityTypeMap:
 			self.logger.debug("Unsupported media type '%s', ignoring", mediaType)
 			return
-		state = stateNotification["state"]
-		sessionKey = int(stateNotification["sessionKey"])
-		viewOffset = int(stateNotification["viewOffset"])
 		try:
-			libraryName: str = item.section().title
+			libraryName = self.metadataCache.fetchLibraryName(item)
 		except:
 			libraryName = "ERROR"
-		if "blacklistedLibraries" in self.serverConfig and libraryName in self.serverConfig["blacklistedLibraries"]:
+		if self.blacklistedLibraries is not None and libraryName in self.blacklistedLibraries:
 			self.logger.debug("Library '%s' is blacklisted, ignoring", libraryName)
 			return
-		if "whitelistedLibraries" in self.serverConfig and libraryName not in self.serverConfig["whitelistedLibraries"]:
+		if self.whitelistedLibraries is not None and libraryName not in self.whitelistedLibraries:
 			self.logger.debug("Library '%s' is not whitelisted, ignoring", libraryName)
 			return
-		if self.lastSessionKey == sessionKey and self.lastRatingKey == ratingKey:
-			if self.updateTimeoutTimer:
-				self.updateTimeoutTimer.cancel()
-				self.updateTimeoutTimer = None
-			if self.lastState == state and self.ignoreCount < self.maximumIgnores:
-				self.logger.debug("Nothing changed, ignoring")
-				self.ignoreCount += 1
-				self.updateTimeoutTimer = threading.Timer(self.updateTimeoutTimerInterval, self.updateTimeout)
-				self.updateTimeoutTimer.start()
-				return
-			else:
-				self.ignoreCount = 0
-				if state == "stopped":
-					self.disconnectRpc()
-					return
-		elif state == "stopped":
-			self.logger.debug("Received 'stopped' state alert from unknown session, ignoring")
-			return
 		if self.isServerOwner:
-			self.logger.debug("Searching sessions for session key %s", sessionKey)
-			sessions: list[PlexSession] = self.server.sessions()
-			if len(sessions) < 1:
-				self.logger.debug("Empty session list, ignoring")
-				return
-			for session in sessions:
-				self.logger.debug("%s, Session Key: %s, Usernames: %s", session, session.sessionKey, session.usernames)
-				if session.sessionKey == sessionKey:
-					self.logger.debug("Session found")
-					sessionUsername: str = session.usernames[0]
-					if sessionUsername.lower() == self.listenForUser.lower():
-						self.logger.debug("Username '%s' matches '%s', continuing", sessionUsername, self.listenForUser)
-						break
-					self.logger.debug("Username '%s' doesn't match '%s', ignoring", sessionUsername, self.listenForUser)
-					return
-			else:
+			sessionUsername = self.getSessionUsername(sessionKey)
+			if sessionUsername is None:
 				self.logger.debug("No matching session found, ignoring")
 				return
-		if self.updateTimeoutTimer:
-			self.updateTimeoutTimer.cancel()
-		self.updateTimeoutTimer = threading.Timer(self.updateTimeoutTimerInterval, self.updateTimeout)
-		self.updateTimeoutTimer.start()
+			if sessionUsername.lower() != self.listenForUser.lower():
+				self.logger.debug("Username '%s' doesn't match '%s', ignoring", sessionUsername, self.listenForUser)
+				return
+			self.logger.debug("Username '%s' matches '%s', continuing", sessionUsername, self.listenForUser)
+		self.updateTimeoutTimer = scheduler.reschedule(self.updateTimeoutTimer, self.updateTimeoutTimerInterval, self.updateTimeout)
+		isNewActivity = (self.lastState, self.lastSessionKey, self.lastRatingKey) != (state, sessionKey, ratingKey)
 		self.lastState, self.lastSessionKey, self.lastRatingKey = state, sessionKey, ratingKey
-		stateStrings: list[str] = []
-		if mediaType == "movie":
-			title = shortTitle = item.title
-			if config["display"]["showDirector"]:
-				if item.directors:
-					for i in item.directors:
-						stateStrings.append(i.tag)
-					if config["display"]["showEdition"] and item.editionTitle:
-						title = title + f" {str(item.editionTitle)}"
-				else:
-					stateStrings.append(item.editionTitle)
-			elif config["display"]["showEdition"] and item.editionTitle:
-				stateStrings.append(item.editionTitle)
-			largeText = item.title
-			thumb = item.thumb
-			smallText = ""
-			smallThumb = ""
-		elif mediaType == "episode":
-			title = shortTitle = item.title
-			grandparent = self.server.fetchItem(item.grandparentRatingKey)
-			stateStrings.append(f"S{item.parentIndex:02}E{item.index:02}")
-			largeText = item.grandparentTitle
-			thumb = item.grandparentThumb
-			smallText = ""
-			smallThumb = ""
-		elif mediaType == "live_episode":
-			title = shortTitle = item.grandparentTitle
-			if item.title != item.grandparentTitle:
-				stateStrings.append(item.title)
-			largeText = "Watching live TV"
-			thumb = item.grandparentThumb
-			smallText = ""
-			smallThumb = ""
-		elif mediaType == "track":
-			title = shortTitle = item.title
-			smallText = item.originalTitle or item.grandparentTitle
-			stateStrings.append(smallText)
-			largeText = item.parentTitle
-			thumb = item.thumb
-			# smallThumb = item.grandparentThumb
-			smallThumb = ""
-
-		else:
-			title = shortTitle = item.title
-			largeText = "Watching a video"
-			thumb = item.thumb
-			smallText = ""
-			smallThumb = ""
-		if state != "playing" and mediaType != "track":
-			if config["display"]["progressMode"] == "remaining":
-				stateStrings.append(f"{formatSeconds((item.duration - viewOffset) / 1000, ':')} left")
-			else:
-				stateStrings.append(f"{formatSeconds(viewOffset / 1000, ':')} elapsed")
-		stateText = " · ".join(stateString for stateString in stateStrings if stateString)
-		thumbUrl = ""
-		thumbUrl = self.uploadToImgur(thumb, config["display"]["posters"]["maxSize"], config["display"]["posters"]["padPoster"]) if thumb and config["display"]["posters"]["enabled"] else ""
-		smallThumbUrl = self.uploadToImgur(smallThumb, config["display"]["posters"]["maxSize"], config["display"]["posters"]["padPoster"]) if smallThumb and config["display"]["posters"]["enabled"] else ""
-		if mediaType:
-			activity: models.discord.Activity = {
-				"type": mediaTypeActivityTypeMap[mediaType],
-				"details": title,
-				"assets": {
-					"large_text": largeText,
-					"large_image": thumbUrl or "logo",
-					"small_text": smallText or state.capitalize(),
-					"small_image": smallThumbUrl or state,
-				},
-			}
-		if stateText:
-			activity["state"] = truncate(stateText, 128)
-		if config["display"]["buttons"]:
-			guidsRaw: list[Guid] = []
-			if mediaType in ["movie", "track"]:
-				guidsRaw = item.guids
-			elif mediaType == "episode":
-				guidsRaw = self.server.fetchItem(item.grandparentRatingKey).guids
-			guids: dict[str, str] = { guidSplit[0]: guidSplit[1] for guidSplit in [guid.id.split("://") for guid in guidsRaw] if len(guidSplit) > 1 }
-			buttons: list[models.discord.ActivityButton] = []
-			for button in config["display"]["buttons"]:
-				if "mediaTypes" in button and mediaType not in button["mediaTypes"]:
-					continue
-				label = truncate(button["label"].format(title = shortTitle), 32)
-				if not button["url"].startswith("dynamic:"):
-					buttons.append({ "label": label, "url": button["url"] })
+		presenceRenderer = getPresenceRenderer()
+		activity, thumb, smallThumb = presenceRenderer.render(item, mediaType, state, viewOffset, libraryName, lambda: self.fetchGuids(item, mediaType))
+		pendingPosters: list[tuple[str, Future[Optional[str]]]] = []
+		if presenceRenderer.postersEnabled:
+			for assetKey, assetThumb in [("large_image", thumb), ("small_image", smallThumb)]:
+				if not assetThumb:
 					continue
-				buttonType = button["url"][8:]
-				guidType = buttonTypeGuidTypeMap.get(buttonType)
-				if not guidType:
-					continue
-				guid = guids.get(guidType)
-				if not guid:
-					continue
-				url = ""
-				if buttonType == "imdb":
-					url = f"https://www.imdb.com/title/{guid}"
-				elif buttonType == "tmdb":
-					tmdbPathSegment = "movie" if mediaType == "movie" else "tv"
-					url = f"https://www.themoviedb.org/{tmdbPathSegment}/{guid}"
-				elif buttonType == "thetvdb":
-					theTvdbPathSegment = "movie" if mediaType == "movie" else "series"
-					url = f"https://www.thetvdb.com/dereferrer/{theTvdbPathSegment}/{guid}"
-				elif buttonType == "trakt":
-					idType = "movie" if mediaType == "movie" else "show"
-					url = f"https://trakt.tv/search/tmdb/{guid}?id_type={idType}"
-				elif buttonType == "letterboxd" and mediaType == "movie":
-					url = f"https://letterboxd.com/tmdb/{guid}"
-				elif buttonType == "musicbrainz":
-					url = f"https://musicbrainz.org/track/{guid}"
-				if url:
-					buttons.append({ "label": label, "url": url })
-			if buttons:
-				activity["buttons"] = buttons[:2]
-			if state == "playing":
-				currentTimestamp = int(time.time() * 1000)
-				match config["display"]["progressMode"]:
-					case "elapsed":
-						activity["timestamps"] = { "start": round(currentTimestamp - viewOffset) }
-					case "remaining":
-						activity["timestamps"] = { "end": round(currentTimestamp + (item.duration - viewOffset)) }
-					case "bar":
-						activity["timestamps"] = { "start": round(currentTimestamp - viewOffset), "end": round(currentTimestamp + (item.duration - viewOffset)) }
-					case _:
-						pass
-		if not self.discordIpcService.connected:
-			self.discordIpcService.connect()
-		if self.discordIpcService.connected:
-			self.discordIpcService.setActivity(activity)
+				assetUrl, assetFuture = self.getPosterUrl(assetThumb)
+				if assetUrl:
+					activity["assets"][assetKey] = assetUrl
+				if assetFuture:
+					pendingPosters.append((assetKey, assetFuture))
+		with self.discordIpcLock:
+			if isNewActivity:
+				self.discordIpcClient.setActivity(activity, alertReceivedAt)
+			else:
+				self.discordIpcClient.refreshActivity(activity, alertReceivedAt)
+			self.lastActivity = activity
+		for assetKey, future in pendingPosters:
+			future.add_done_callback(lambda future, assetKey = assetKey: self.handlePosterUploaded(activity, assetKey, future))
@@ -0,0 +1,22 @@
+from .imgur import uploadToImgur
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from utils.cache import getCacheKey, setCacheKey
+from utils.singleflight import SingleFlight
+
+posterWorkerCount = 4
+posterFailureTtl = 60
+posterExecutor = ThreadPoolExecutor(max_workers = posterWorkerCount, thread_name_prefix = "PosterWorker")
+posterUploads: SingleFlight[str] = SingleFlight(posterFailureTtl)
+
+def requestPoster(thumb: str, url: str, maxSize: int = 0, padPoster: bool = False) -> Future[Optional[str]]:
+	return posterUploads.submit((thumb, maxSize, padPoster), posterExecutor, uploadPoster, thumb, url, maxSize, padPoster)
+
+def uploadPoster(thumb: str, url: str, maxSize: int, padPoster: bool) -> Optional[str]:
+	thumbUrl = getCacheKey(thumb)
+	if thumbUrl and isinstance(thumbUrl, str):
+		return thumbUrl
+	thumbUrl = uploadToImgur(url, maxSize, padPoster)
+	if thumbUrl:
+		setCacheKey(thumb, thumbUrl)
+	return thumbUrl
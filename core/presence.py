@@ -0,0 +1,225 @@
+from .config import config
+from plexapi.base import PlexPartialObject
+from plexapi.media import Guid
+from typing import Any, Callable, Optional
+from utils.logging import logger
+from utils.text import formatSeconds, truncate
+import models.config
+import models.discord
+import string
+import time
+
+mediaTypeActivityTypeMap = {
+	"movie": models.discord.ActivityType.WATCHING,
+	"episode": models.discord.ActivityType.WATCHING,
+	"live_episode": models.discord.ActivityType.WATCHING,
+	"track": models.discord.ActivityType.LISTENING,
+	"clip": models.discord.ActivityType.WATCHING,
+}
+buttonTypeGuidTypeMap = {
+	"imdb": "imdb",
+	"tmdb": "tmdb",
+	"thetvdb": "tvdb",
+	"trakt": "tmdb",
+	"letterboxd": "tmdb",
+	"musicbrainz": "mbid",
+}
+guidMediaTypes = frozenset(["movie", "episode", "track"])
+commonTemplateFields = frozenset(["title", "state", "progress", "library"])
+templateFields = {
+	"movie": commonTemplateFields | { "year", "directors", "edition" },
+	"episode": commonTemplateFields | { "showTitle", "seasonNumber", "episodeNumber" },
+	"live_episode": commonTemplateFields | { "showTitle" },
+	"track": commonTemplateFields | { "artist", "album" },
+	"clip": commonTemplateFields,
+}
+templateKeys = ["details", "state", "largeText"]
+
+# title, short title, state strings, large text, thumb, small text, small thumb
+RenderedMedia = tuple[str, str, list[str], str, str, str, str]
+MediaRenderer = Callable[[PlexPartialObject], RenderedMedia]
+CompiledButton = tuple[str, str, str]
+
+def getButtonUrlFormat(buttonType: str, mediaType: str) -> str:
+	match buttonType:
+		case "imdb":
+			return "https://www.imdb.com/title/{}"
+		case "tmdb":
+			return f"https://www.themoviedb.org/{'movie' if mediaType == 'movie' else 'tv'}/{{}}"
+		case "thetvdb":
+			return f"https://www.thetvdb.com/dereferrer/{'movie' if mediaType == 'movie' else 'series'}/{{}}"
+		case "trakt":
+			return f"https://trakt.tv/search/tmdb/{{}}?id_type={'movie' if mediaType == 'movie' else 'show'}"
+		case "letterboxd":
+			return "https://letterboxd.com/tmdb/{}" if mediaType == "movie" else ""
+		case "musicbrainz":
+			return "https://musicbrainz.org/track/{}"
+		case _:
+			return ""
+
+def compileMovieRenderer(showDirector: bool, showEdition: bool) -> MediaRenderer:
+	def renderMovie(item: PlexPartialObject) -> RenderedMedia:
+		title = item.title
+		stateStrings: list[str] = []
+		if showDirector:
+			if item.directors:
+				stateStrings.extend(director.tag for director in item.directors)
+				if showEdition and item.editionTitle:
+					title = f"{title} {item.editionTitle}"
+			else:
+				stateStrings.append(item.editionTitle)
+		elif showEdition and item.editionTitle:
+			stateStrings.append(item.editionTitle)
+		return title, item.title, stateStrings, item.title, item.thumb, "", ""
+	return renderMovie
+
+def renderEpisode(item: PlexPartialObject) -> RenderedMedia:
+	return item.title, item.title, [f"S{item.parentIndex:02}E{item.index:02}"], item.grandparentTitle, item.grandparentThumb, "", ""
+
+def renderLiveEpisode(item: PlexPartialObject) -> RenderedMedia:
+	stateStrings = [item.title] if item.title != item.grandparentTitle else []
+	return item.grandparentTitle, item.grandparentTitle, stateStrings, "Watching live TV", item.grandparentThumb, "", ""
+
+def renderTrack(item: PlexPartialObject) -> RenderedMedia:
+	artist = item.originalTitle or item.grandparentTitle
+	return item.title, item.title, [artist], item.parentTitle, item.thumb, artist, ""
+
+def renderClip(item: PlexPartialObject) -> RenderedMedia:
+	return item.title, item.title, [], "Watching a video", item.thumb, "", ""
+
+def getTemplateFields(item: PlexPartialObject, mediaType: str) -> dict[str, Any]:
+	match mediaType:
+		case "movie":
+			return { "year": item.year or "", "directors": ", ".join(director.tag for director in item.directors), "edition": item.editionTitle or "" }
+		case "episode":
+			return { "showTitle": item.grandparentTitle, "seasonNumber": item.parentIndex, "episodeNumber": item.index }
+		case "live_episode":
+			return { "showTitle": item.grandparentTitle }
+		case "track":
+			return { "artist": item.originalTitle or item.grandparentTitle, "album": item.parentTitle }
+		case _:
+			return {}
+
+def compileTemplate(mediaType: str, key: str, template: str) -> Optional[str]:
+	try:
+		fieldNames = { fieldName.split(".")[0].split("[")[0] for _, fieldName, _, _ in string.Formatter().parse(template) if fieldName is not None }
+	except ValueError as e:
+		logger.warning("Invalid '%s' format for media type '%s': %s", key, mediaType, e)
+		return None
+	unknownFieldNames = fieldNames - templateFields[mediaType]
+	if unknownFieldNames:
+		logger.warning("Unknown fields in '%s' format for media type '%s': %s", key, mediaType, ", ".join(sorted(unknownFieldNames)))
+		return None
+	return template
+
+class PresenceRenderer:
+
+	def __init__(self, display: models.config.Display) -> None:
+		self.progressMode = display["progressMode"]
+		self.postersEnabled = display["posters"]["enabled"]
+		self.mediaRenderers: dict[str, MediaRenderer] = {
+			"movie": compileMovieRenderer(display.get("showDirector", True), display.get("showEdition", True)),
+			"episode": renderEpisode,
+			"live_episode": renderLiveEpisode,
+			"track": renderTrack,
+			"clip": renderClip,
+		}
+		formats = display.get("formats", {})
+		self.templates: dict[str, dict[str, str]] = {}
+		self.buttons: dict[str, list[CompiledButton]] = {}
+		for mediaType in mediaTypeActivityTypeMap:
+			self.templates[mediaType] = {}
+			for key, template in formats.get(mediaType, {}).items():
+				if key not in templateKeys:
+					logger.warning("Unknown format '%s' for media type '%s'", key, mediaType)
+					continue
+				compiledTemplate = compileTemplate(mediaType, key, template)
+				if compiledTemplate is not None:
+					self.templates[mediaType][key] = compiledTemplate
+			self.buttons[mediaType] = self.compileButtons(mediaType, display["buttons"])
+
+	def compileButtons(self, mediaType: str, buttons: list[models.config.Button]) -> list[CompiledButton]:
+		compiledButtons: list[CompiledButton] = []
+		for button in buttons:
+			if "mediaTypes" in button and mediaType not in button["mediaTypes"]:
+				continue
+			if not button["url"].startswith("dynamic:"):
+				compiledButtons.append((button["label"], "", button["url"]))
+				continue
+			if mediaType not in guidMediaTypes:
+				continue
+			buttonType = button["url"][8:]
+			guidType = buttonTypeGuidTypeMap.get(buttonType)
+			urlFormat = getButtonUrlFormat(buttonType, mediaType)
+			if guidType and urlFormat:
+				compiledButtons.append((button["label"], guidType, urlFormat))
+		return compiledButtons
+
+	def render(self, item: PlexPartialObject, mediaType: str, state: str, viewOffset: int, libraryName: str, fetchGuids: Callable[[], list[Guid]]) -> tuple[models.discord.Activity, str, str]:
+		title, shortTitle, stateStrings, largeText, thumb, smallText, smallThumb = self.mediaRenderers[mediaType](item)
+		progress = ""
+		if state != "playing" and mediaType != "track":
+			if self.progressMode == "remaining":
+				progress = f"{formatSeconds((item.duration - viewOffset) / 1000, ':')} left"
+			else:
+				progress = f"{formatSeconds(viewOffset / 1000, ':')} elapsed"
+			stateStrings.append(progress)
+		stateText = " · ".join(stateString for stateString in stateStrings if stateString)
+		templates = self.templates[mediaType]
+		if templates:
+			fields = getTemplateFields(item, mediaType)
+			fields.update(title = shortTitle, state = state.capitalize(), progress = progress, library = libraryName)
+			title = templates["details"].format_map(fields) if "details" in templates else title
+			stateText = templates["state"].format_map(fields) if "state" in templates else stateText
+			largeText = templates["largeText"].format_map(fields) if "largeText" in templates else largeText
+		activity: models.discord.Activity = {
+			"type": mediaTypeActivityTypeMap[mediaType],
+			"details": truncate(title, 128),
+			"assets": {
+				"large_text": truncate(largeText, 128),
+				"large_image": "logo",
+				"small_text": smallText or state.capitalize(),
+				"small_image": state,
+			},
+		}
+		if stateText:
+			activity["state"] = truncate(stateText, 128)
+		buttons = self.buttons[mediaType]
+		if buttons:
+			guids: dict[str, str] = {}
+			if any(guidType for _, guidType, _ in buttons):
+				guids = { guidSplit[0]: guidSplit[1] for guidSplit in [guid.id.split("://") for guid in fetchGuids()] if len(guidSplit) > 1 }
+			activityButtons: list[models.discord.ActivityButton] = []
+			for label, guidType, url in buttons:
+				if guidType:
+					guid = guids.get(guidType)
+					if not guid:
+						continue
+					url = url.format(guid)
+				activityButtons.append({ "label": truncate(label.format(title = shortTitle), 32), "url": url })
+				if len(activityButtons) == 2:
+					break
+			if activityButtons:
+				activity["buttons"] = activityButtons
+		if state == "playing":
+			currentTimestamp = int(time.time() * 1000)
+			match self.progressMode:
+				case "elapsed":
+					activity["timestamps"] = { "start": round(currentTimestamp - viewOffset) }
+				case "remaining":
+					activity["timestamps"] = { "end": round(currentTimestamp + (item.duration - viewOffset)) }
+				case "bar":
+					activity["timestamps"] = { "start": round(currentTimestamp - viewOffset), "end": round(currentTimestamp + (item.duration - viewOffset)) }
+				case _:
+					pass
+		return activity, thumb, smallThumb
+
+presenceRenderer: Optional[PresenceRenderer] = None
+
+def compilePresenceRenderer() -> PresenceRenderer:
+	global presenceRenderer
+	presenceRenderer = PresenceRenderer(config["display"])
+	return presenceRenderer
+
+def getPresenceRenderer() -> PresenceRenderer:
+	return presenceRenderer or compilePresenceRenderer()
@@ -0,0 +1,110 @@
+# pyright: reportUnknownArgumentType=none,reportUnknownMemberType=none,reportUnknownVariableType=none
+
+from .plex import PlexAlertListener
+from concurrent.futures import ThreadPoolExecutor
+from plexapi.alert import AlertListener
+from utils.logging import logger
+from utils.metrics import incrementCounter
+from utils.websocket import WebSocketConnection, connectWebSocket
+import asyncio
+import json
+import models.config
+import threading
+import time
+
+class AsyncRuntime:
+
+	workerCount = 4
+	pingInterval = 30
+
+	def __init__(self) -> None:
+		self.loop = asyncio.new_event_loop()
+		self.executor = ThreadPoolExecutor(max_workers = self.workerCount, thread_name_prefix = "PlexWorker")
+		self.loop.set_default_executor(self.executor)
+		self.thread = threading.Thread(target = self.loop.run_forever, name = "AsyncRuntime", daemon = True)
+		self.tasks: dict[PlexAlertListener, asyncio.Task[None]] = {}
+		self.webSockets: dict[PlexAlertListener, WebSocketConnection] = {}
+
+	def start(self) -> None:
+		logger.info("Starting asyncio runtime")
+		self.thread.start()
+
+	def createListener(self, token: str, serverConfig: models.config.Server) -> PlexAlertListener:
+		plexAlertListener = PlexAlertListener(token, serverConfig, self.loop)
+		self.loop.call_soon_threadsafe(self.startListener, plexAlertListener)
+		return plexAlertListener
+
+	def startListener(self, plexAlertListener: PlexAlertListener) -> None:
+		self.tasks[plexAlertListener] = self.loop.create_task(self.listen(plexAlertListener))
+
+	async def listen(self, plexAlertListener: PlexAlertListener) -> None:
+		while True:
+			await asyncio.sleep(plexAlertListener.getWaitTime())
+			delay = 0.0
+			connectedAt, lastReceivedAt = 0.0, 0.0
+			try:
+				plexAlertListener.setConnectionState("connecting")
+				await self.loop.run_in_executor(None, plexAlertListener.connectServer)
+				assert plexAlertListener.server
+				url = plexAlertListener.server.url(AlertListener.key, includeToken = True).replace("http", "ws", 1)
+				webSocket = await connectWebSocket(url)
+				connectedAt = time.monotonic()
+				self.webSockets[plexAlertListener] = webSocket
+				plexAlertListener.logger.info("Listening for alerts from user '%s'", plexAlertListener.listenForUser)
+				plexAlertListener.setConnectionState("connected")
+				keepAliveTask = self.loop.create_task(self.keepAlive(webSocket))
+				try:
+					while True:
+						alert = json.loads(await webSocket.recv())["NotificationContainer"]
+						await self.loop.run_in_executor(None, plexAlertListener.tryHandleAlert, alert)
+				finally:
+					keepAliveTask.cancel()
+					lastReceivedAt = webSocket.lastReceivedAt
+			except Exception as e:
+				if plexAlertListener.connectionState == "connected":
+					plexAlertListener.logger.error("Connection to Plex lost: %s", e)
+					incrementCounter("plex_reconnects_total", labels = plexAlertListener.metricLabels)
+					plexAlertListener.setConnectionState("disconnected")
+				else:
+					connectedAt = 0.0
+					delay = plexAlertListener.connectionFailed(e)
+			finally:
+				webSocket = self.webSockets.pop(plexAlertListener, None)
+				if webSocket:
+					await webSocket.close()
+			await self.loop.run_in_executor(None, plexAlertListener.disconnect)
+			if connectedAt:
+				delay = plexAlertListener.connectionClosed(connectedAt, lastReceivedAt)
+			await asyncio.sleep(delay)
+
+	async def keepAlive(self, webSocket: WebSocketConnection) -> None:
+		while True:
+			await asyncio.sleep(self.pingInterval)
+			if time.monotonic() - webSocket.lastReceivedAt > self.pingInterval * 2:
+				logger.debug("No response to WebSocket pings, closing connection")
+				await webSocket.close()
+				return
+			await webSocket.ping()
+
+	async def stopListener(self, plexAlertListener: PlexAlertListener) -> None:
+		task = self.tasks.pop(plexAlertListener, None)
+		if task:
+			task.cancel()
+			await asyncio.gather(task, return_exceptions = True)
+		webSocket = self.webSockets.pop(plexAlertListener, None)
+		if webSocket:
+			await webSocket.close()
+		plexAlertListener.setConnectionState("disconnected")
+		await self.loop.run_in_executor(None, plexAlertListener.disconnect)
+		await asyncio.wrap_future(plexAlertListener.discordIpcClient.release())
+
+	async def stopListeners(self) -> None:
+		await asyncio.gather(*(self.stopListener(plexAlertListener) for plexAlertListener in list(self.tasks)))
+
+	def removeListener(self, plexAlertListener: PlexAlertListener) -> None:
+		asyncio.run_coroutine_threadsafe(self.stopListener(plexAlertListener), self.loop).result()
+
+	def stop(self) -> None:
+		asyncio.run_coroutine_threadsafe(self.stopListeners(), self.loop).result()
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.executor.shutdown(wait = False)
@@ -45,17 +45,23 @@ if not noPipInstall:
 		logger.exception("An unexpected error occured during automatic installation of dependencies. Install them manually by running the following command: python -m pip install -U -r requirements.txt")
 
 from config.constants import dataDirectoryPath, logFilePath, name, version, isInteractive
-from core.config import config, loadConfig, saveConfig
+from core.config import config, loadConfig, saveConfig, watchConfig
 from core.discord import DiscordIpcService
 from core.plex import PlexAlertListener, initiateAuth, getAuthToken
+from core.presence import compilePresenceRenderer
+from core.runtime import AsyncRuntime
 from typing import Optional
-from utils.cache import loadCache
-from utils.logging import formatter
+from utils.cache import loadCache, closeCache
+from utils.metrics import startMetricsServer
+from utils.logging import startFileLogging, stopFileLogging
 from utils.text import formatSeconds
+import copy
 import logging
 import models.config
 import time
 
+ListenerKey = tuple[str, str, Optional[int]]
+
 def init() -> None:
 	if not os.path.isdir(dataDirectoryPath):
 		os.makedirs(dataDirectoryPath)
@@ -66,11 +72,14 @@ def init() -> None:
 	if config["logging"]["debug"]:
 		logger.setLevel(logging.DEBUG)
 	if config["logging"]["writeToFile"]:
-		fileHandler = logging.FileHandler(logFilePath)
-		fileHandler.setFormatter(formatter)
-		logger.addHandler(fileHandler)
+		startFileLogging(logFilePath, config["logging"]["maxFileSize"], config["logging"]["backupCount"])
 	logger.info("%s - v%s", name, version)
-	loadCache()
+	loadCache(config["cache"]["backend"], config["cache"]["maxEntries"], config["cache"]["ttlDays"] * 86400)
+	if config["metrics"]["enabled"]:
+		try:
+			startMetricsServer(config["metrics"]["host"], config["metrics"]["port"])
+		except OSError as e:
+			logger.error("Failed to start the metrics server: %s", e)
 
 def main() -> None:
 	init()
@@ -81,7 +90,21 @@ def main() -> None:
 			exit(1)
 		config["users"].append(user)
 		saveConfig()
-	plexAlertListeners = [PlexAlertListener(user["token"], server) for user in config["users"] for server in user["servers"]]
+	asyncRuntime: Optional[AsyncRuntime] = None
+	if config["runtime"] == "asyncio":
+		asyncRuntime = AsyncRuntime()
+		asyncRuntime.start()
+	plexAlertListeners: dict[ListenerKey, PlexAlertListener] = {}
+	reconcilePlexAlertListeners(plexAlertListeners, asyncRuntime)
+	restartRequiredSettings = getRestartRequiredSettings()
+	def handleConfigReload() -> None:
+		logger.setLevel(logging.DEBUG if config["logging"]["debug"] else logging.INFO)
+		if getRestartRequiredSettings() != restartRequiredSettings:
+			logger.warning("Changes to the runtime, cache, metrics and file logging settings take effect after a restart")
+		compilePresenceRenderer()
+		reconcilePlexAlertListeners(plexAlertListeners, asyncRuntime)
+		logger.info("Config file reloaded")
+	watchConfig(handleConfigReload)
 	try:
 		if isInteractive:
 			while True:
@@ -92,8 +115,37 @@ def main() -> None:
 			while True:
 				time.sleep(3600)
 	except KeyboardInterrupt:
-		for plexAlertListener in plexAlertListeners:
-			plexAlertListener.disconnect()
+		if asyncRuntime:
+			asyncRuntime.stop()
+		else:
+			for plexAlertListener in plexAlertListeners.values():
+				plexAlertListener.stop()
+		closeCache()
+		stopFileLogging()
+
+def getRestartRequiredSettings() -> tuple[str, models.config.Cache, models.config.Metrics, tuple[bool, int, int]]:
+	fileLoggingSettings = config["logging"]["writeToFile"], config["logging"]["maxFileSize"], config["logging"]["backupCount"]
+	return config["runtime"], copy.deepcopy(config["cache"]), copy.deepcopy(config["metrics"]), fileLoggingSettings
+
+def getListenerKey(token: str, serverConfig: models.config.Server) -> ListenerKey:
+	return token, serverConfig["name"].lower(), serverConfig.get("ipcPipeNumber") # pyright: ignore[reportTypedDictNotRequiredAccess]
+
+def reconcilePlexAlertListeners(plexAlertListeners: dict[ListenerKey, PlexAlertListener], asyncRuntime: Optional[AsyncRuntime]) -> None:
+	serverConfigs = { getListenerKey(user["token"], serverConfig): (user["token"], serverConfig) for user in config["users"] for serverConfig in user["servers"] }
+	for key in [key for key in plexAlertListeners if key not in serverConfigs]:
+		plexAlertListener = plexAlertListeners.pop(key)
+		plexAlertListener.logger.info("Server removed from the config file, stopping")
+		if asyncRuntime:
+			asyncRuntime.removeListener(plexAlertListener)
+		else:
+			plexAlertListener.stop()
+	for key, (token, serverConfig) in serverConfigs.items():
+		if key in plexAlertListeners:
+			plexAlertListeners[key].setServerConfig(serverConfig)
+		elif asyncRuntime:
+			plexAlertListeners[key] = asyncRuntime.createListener(token, serverConfig)
+		else:
+			plexAlertListeners[key] = PlexAlertListener(token, serverConfig)
 
 def authNewUser() -> Optional[models.config.User]:
 	id, code, url = initiateAuth()
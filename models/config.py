@@ -3,6 +3,8 @@ from typing import TypedDict
 class Logging(TypedDict):
 	debug: bool
 	writeToFile: bool
+	maxFileSize: int
+	backupCount: int
 
 class Posters(TypedDict):
 	enabled: bool
@@ -14,11 +16,29 @@ class Button(TypedDict):
 	url: str
 	mediaTypes: list[str]
 
+class Format(TypedDict, total = False):
+	details: str
+	state: str
+	largeText: str
+
 class Display(TypedDict):
 	hideTotalTime: bool
 	progressMode: str
+	showDirector: bool
+	showEdition: bool
 	posters: Posters
 	buttons: list[Button]
+	formats: dict[str, Format]
+
+class Cache(TypedDict):
+	backend: str
+	maxEntries: int
+	ttlDays: float
+
+class Metrics(TypedDict):
+	enabled: bool
+	host: str
+	port: int
 
 class Server(TypedDict, total = False):
 	name: str
@@ -26,6 +46,7 @@ class Server(TypedDict, total = False):
 	blacklistedLibraries: list[str]
 	whitelistedLibraries: list[str]
 	ipcPipeNumber: int
+	ipcPriority: int
 
 class User(TypedDict):
 	token: str
@@ -33,5 +54,8 @@ class User(TypedDict):
 
 class Config(TypedDict):
 	logging: Logging
+	runtime: str
 	display: Display
+	cache: Cache
+	metrics: Metrics
 	users: list[User]
@@ -6,6 +6,21 @@ class StateNotification(TypedDict):
 	ratingKey: int
 	viewOffset: int
 
+class TimelineEntry(TypedDict):
+	identifier: str
+	itemID: int
+	type: int
+	state: int
+
+class ActivityDetails(TypedDict):
+	type: str
+
+class ActivityNotification(TypedDict):
+	event: str
+	Activity: ActivityDetails
+
 class Alert(TypedDict):
 	type: str
 	PlaySessionStateNotification: list[StateNotification]
+	TimelineEntry: list[TimelineEntry]
+	ActivityNotification: list[ActivityNotification]
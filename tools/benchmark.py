@@ -0,0 +1,515 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from typing import Any, Callable, Optional
+from utils.logging import logger
+import asyncio
+import json
+import logging
+import multiprocessing
+import struct
+import tempfile
+import threading
+import time
+
+def timeCall(func: Callable[[], None], repeat: int = 5) -> float:
+	timings: list[float] = []
+	for _ in range(repeat):
+		startTime = time.perf_counter()
+		func()
+		timings.append(time.perf_counter() - startTime)
+	return min(timings) * 1000
+
+def benchmarkCache() -> None:
+	from utils.cache import JsonCacheStorage, SqliteCacheStorage
+	print(f"{'entries':>8} | {'full rewrite (ms)':>18} | {'json set (µs)':>14} | {'json flush (ms)':>15} | {'sqlite set (µs)':>16} | {'sqlite get (µs)':>16}")
+	for size in [100, 1000, 5000, 20000]:
+		jsonCacheStorage = JsonCacheStorage(filePath = f"data/cache-{size}.json")
+		jsonCacheStorage.flushThreshold = sys.maxsize
+		sqliteCacheStorage = SqliteCacheStorage(filePath = f"data/cache-{size}.sqlite")
+		sqliteCacheStorage.load()
+		for i in range(size):
+			jsonCacheStorage.entries[f"/library/metadata/{i}/thumb/1700000000"] = (f"https://i.imgur.com/{i:07}.png", time.time())
+			sqliteCacheStorage.set(f"/library/metadata/{i}/thumb/1700000000", f"https://i.imgur.com/{i:07}.png")
+		legacyCache = { key: value for key, (value, _) in jsonCacheStorage.entries.items() }
+		def fullRewrite() -> None:
+			with open(jsonCacheStorage.filePath, "w", encoding = "UTF-8") as cacheFile:
+				json.dump(legacyCache, cacheFile, separators = (",", ":"))
+		def jsonSet() -> None:
+			for i in range(1000):
+				jsonCacheStorage.set(f"/library/metadata/{i}/thumb/1800000000", "https://i.imgur.com/new.png")
+		def jsonFlush() -> None:
+			jsonCacheStorage.dirtyKeys.add("dirty")
+			jsonCacheStorage.flush()
+		def sqliteSet() -> None:
+			for i in range(1000):
+				sqliteCacheStorage.set(f"/library/metadata/{i}/thumb/1800000000", "https://i.imgur.com/new.png")
+		def sqliteGet() -> None:
+			for i in range(1000):
+				sqliteCacheStorage.get(f"/library/metadata/{i}/thumb/1700000000")
+		print(f"{size:>8} | {timeCall(fullRewrite):>18.3f} | {timeCall(jsonSet, 1):>14.3f} | {timeCall(jsonFlush):>15.3f} | {timeCall(sqliteSet, 1):>16.3f} | {timeCall(sqliteGet, 1):>16.3f}")
+		sqliteCacheStorage.close()
+
+def legacyProcessImage(imageBytes: bytes, maxSize: int = 0, padPoster: bool = False) -> bytes:
+	from PIL import Image, ImageOps
+	import io
+	originalImage = Image.open(io.BytesIO(imageBytes))
+	newImage = Image.new("RGBA", originalImage.size)
+	newImage.putdata(originalImage.getdata()) # pyright: ignore[reportUnknownMemberType,reportUnknownArgumentType]
+	if maxSize:
+		newImage.thumbnail((maxSize, maxSize))
+	if padPoster:
+		newImage = ImageOps.pad(newImage, (maxSize, maxSize), color=(255,255,255,0))
+	newImageBytesIO = io.BytesIO()
+	newImage.save(newImageBytesIO, subsampling = 0, quality = 90, format = "PNG")
+	return newImageBytesIO.getvalue()
+
+def createPoster(width: int = 2000, height: int = 3000) -> bytes:
+	from PIL import Image
+	import io
+	image = Image.radial_gradient("L").resize((width, height)).convert("RGB")
+	image = Image.merge("RGB", (image.getchannel(0), image.getchannel(0).rotate(90), Image.effect_noise((width, height), 64)))
+	imageBytesIO = io.BytesIO()
+	image.save(imageBytesIO, format = "JPEG", quality = 90)
+	return imageBytesIO.getvalue()
+
+def runPosterTransform(useLegacy: bool, imageBytes: bytes, iterations: int, results: "multiprocessing.Queue[tuple[float, int, bytes]]") -> None:
+	from core.imgur import processImage
+	import resource
+	transform = legacyProcessImage if useLegacy else processImage
+	startTime = time.perf_counter()
+	for _ in range(iterations):
+		output = transform(imageBytes, 256, True)
+	elapsed = (time.perf_counter() - startTime) / iterations * 1000
+	results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, output)) # pyright: ignore[reportPossiblyUnbound]
+
+def benchmarkPoster() -> None:
+	from PIL import Image, ImageChops, ImageStat
+	import io
+	imageBytes = createPoster()
+	outputs: list[bytes] = []
+	print(f"{'pipeline':>8} | {'ms/poster':>10} | {'peak RSS (MiB)':>15}")
+	for useLegacy in [True, False]:
+		results: "multiprocessing.Queue[tuple[float, int, bytes]]" = multiprocessing.Queue()
+		process = multiprocessing.Process(target = runPosterTransform, args = (useLegacy, imageBytes, 5, results))
+		process.start()
+		elapsed, peakRss, output = results.get()
+		process.join()
+		outputs.append(output)
+		print(f"{'before' if useLegacy else 'after':>8} | {elapsed:>10.1f} | {peakRss / 1024:>15.1f}")
+	before, after = (Image.open(io.BytesIO(output)) for output in outputs)
+	print(f"Output size: {before.size} / {after.size}, mean channel difference: {ImageStat.Stat(ImageChops.difference(before, after)).mean}")
+
+class FakeDiscordServer:
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		self.receivedAt: list[float] = []
+		self.handshakes = 0
+		self.loop = asyncio.new_event_loop()
+		threading.Thread(target = self.loop.run_forever, daemon = True).start()
+		asyncio.run_coroutine_threadsafe(asyncio.start_unix_server(self.handleClient, path), self.loop).result()
+
+	async def handleClient(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		try:
+			while True:
+				op, length = struct.unpack("<ii", await reader.readexactly(8))
+				payload = json.loads(await reader.readexactly(length))
+				self.receivedAt.append(time.perf_counter())
+				if op == 0:
+					self.handshakes += 1
+					response = { "cmd": "DISPATCH", "evt": "READY", "data": { "v": 1, "user": { "id": "0", "username": "benchmark" } } }
+				else:
+					response = { "cmd": payload["cmd"], "nonce": payload.get("nonce"), "data": payload["args"].get("activity"), "evt": None }
+				responseBytes = json.dumps(response).encode("utf-8")
+				writer.write(struct.pack("<ii", 1, len(responseBytes)) + responseBytes)
+				await writer.drain()
+		except (asyncio.IncompleteReadError, ConnectionError):
+			writer.close()
+
+def formatPercentiles(values: list[float]) -> str:
+	if not values:
+		return "n/a"
+	values = sorted(values)
+	return " | ".join(f"{values[min(len(values) - 1, int(len(values) * percentile))]:>8.3f}" for percentile in [0.5, 0.95, 0.99])
+
+def benchmarkIpc() -> None:
+	from core.discord import DiscordIpcService
+	fakeDiscordServer = FakeDiscordServer(os.path.abspath("discord-ipc-0"))
+	activity = { "details": "details", "state": "state", "assets": { "large_text": "large_text", "large_image": "logo", "small_text": "small_text", "small_image": "playing" } }
+	print(f"{'mode':>10} | {'latency from setActivity call to activity written (ms)':>54}")
+	print(f"{'':>10} | {'p50':>8} | {'p95':>8} | {'p99':>8} | {'caller blocked (ms, p50)':>24} | {'handshakes':>10}")
+	for reconnect in [True, False]:
+		discordIpcService = DiscordIpcService(0)
+		discordIpcService.pipes = [fakeDiscordServer.path]
+		discordIpcService.activityRateLimit = discordIpcService.activityTokens = sys.maxsize
+		latencies: list[float] = []
+		blockedTimes: list[float] = []
+		fakeDiscordServer.handshakes = 0
+		for i in range(200):
+			activity["details"] = f"details {i}"
+			fakeDiscordServer.receivedAt.clear()
+			requestedAt = time.perf_counter()
+			if reconnect:
+				discordIpcService.connect()
+				fakeDiscordServer.receivedAt.clear()
+			future = discordIpcService.setActivity(activity) # pyright: ignore[reportArgumentType]
+			blockedTimes.append((time.perf_counter() - requestedAt) * 1000)
+			future.result()
+			latencies.append((fakeDiscordServer.receivedAt[-1] - requestedAt) * 1000)
+			if reconnect:
+				discordIpcService.disconnect()
+		if discordIpcService.connected:
+			discordIpcService.disconnect()
+		print(f"{'reconnect' if reconnect else 'persistent':>10} | {formatPercentiles(latencies)} | {sorted(blockedTimes)[len(blockedTimes) // 2]:>24.3f} | {fakeDiscordServer.handshakes:>10}")
+	from utils.metrics import getCounter
+	discordIpcService = DiscordIpcService(1)
+	discordIpcService.pipes = [fakeDiscordServer.path]
+	futures = []
+	for i in range(100):
+		activity["details"] = f"details {i // 2}"
+		futures.append(discordIpcService.setActivity(activity)) # pyright: ignore[reportArgumentType]
+	for future in futures:
+		future.result()
+	labels = { "pipe": "1" }
+	print(f"Burst of 100 updates (50 distinct): {getCounter('discord_activity_updates_sent_total', labels):.0f} sent, {getCounter('discord_activity_updates_coalesced_total', labels):.0f} coalesced, {getCounter('discord_activity_updates_skipped_total', labels):.0f} skipped")
+	discordIpcService.disconnect()
+
+def benchmarkIpcFrames() -> None:
+	from core.discord import IpcFrameDecoder
+	import random
+	generator = random.Random(0)
+	frames: list[tuple[int, Any]] = []
+	for i in range(1000):
+		size = generator.choice([16, 256, 4096, 32768])
+		frames.append((generator.randrange(5), { "cmd": "DISPATCH", "nonce": str(i), "data": "x" * generator.randrange(size) }))
+	stream = b"".join(struct.pack("<ii", op, len(payloadBytes)) + payloadBytes for op, payloadBytes in ((op, json.dumps(payload).encode("utf-8")) for op, payload in frames))
+	for maximumChunkSize in [16, 1024, 65536, len(stream)]:
+		for _ in range(3):
+			frameDecoder = IpcFrameDecoder()
+			decodedFrames: list[tuple[int, Any]] = []
+			position = 0
+			startTime = time.perf_counter()
+			while position < len(stream):
+				chunkSize = generator.randint(1, maximumChunkSize)
+				decodedFrames.extend(frameDecoder.feed(stream[position:position + chunkSize]))
+				position += chunkSize
+			elapsed = time.perf_counter() - startTime
+			assert decodedFrames == frames and not frameDecoder.buffer, f"Decoded frames differ (maximum chunk size: {maximumChunkSize})"
+		print(f"Maximum chunk size {maximumChunkSize:>9}: {len(frames) / elapsed:>10.0f} frames/s, {len(stream) / elapsed / 1024 / 1024:>8.1f} MiB/s")
+
+def createFakeItems() -> dict[str, Any]:
+	from types import SimpleNamespace
+	guids = [SimpleNamespace(id = "imdb://tt0000001"), SimpleNamespace(id = "tmdb://1"), SimpleNamespace(id = "tvdb://1")]
+	return {
+		"movie": SimpleNamespace(title = "Movie", year = 2000, directors = [SimpleNamespace(tag = "Director")], editionTitle = "Director's Cut", thumb = "/library/metadata/1/thumb/1", duration = 7200000, guids = guids),
+		"episode": SimpleNamespace(title = "Episode", grandparentTitle = "Show", parentIndex = 1, index = 2, grandparentThumb = "/library/metadata/2/thumb/1", duration = 2400000, guids = guids),
+		"live_episode": SimpleNamespace(title = "News", grandparentTitle = "Channel", grandparentThumb = "/library/metadata/3/thumb/1", duration = 3600000, guids = []),
+		"track": SimpleNamespace(title = "Track", originalTitle = "", grandparentTitle = "Artist", parentTitle = "Album", thumb = "/library/metadata/4/thumb/1", duration = 240000, guids = guids),
+		"clip": SimpleNamespace(title = "Clip", thumb = "/library/metadata/5/thumb/1", duration = 60000, guids = []),
+	}
+
+def benchmarkPresence() -> None:
+	from core.config import config
+	from core.presence import PresenceRenderer
+	from copy import deepcopy
+	display = deepcopy(config["display"])
+	display["buttons"] = [{ "label": "{title} on IMDb", "url": "dynamic:imdb" }, { "label": "TMDB", "url": "dynamic:tmdb" }, { "label": "Music Stats", "url": "https://github.com", "mediaTypes": ["track"] }]
+	formattedDisplay = deepcopy(display)
+	formattedDisplay["formats"] = {
+		"movie": { "details": "{title} ({year})", "state": "{directors} · {progress}" },
+		"episode": { "details": "{showTitle}", "state": "{title} · S{seasonNumber:02}E{episodeNumber:02}", "largeText": "{library}" },
+		"track": { "state": "{artist} · {album}" },
+	}
+	items = createFakeItems()
+	iterations = 20000
+	print(f"{'media type':>12} | {'default (renders/s)':>20} | {'formats (renders/s)':>20}")
+	for mediaType, item in items.items():
+		results: list[float] = []
+		for presenceRenderer in [PresenceRenderer(display), PresenceRenderer(formattedDisplay)]:
+			for state in ["playing", "paused"]:
+				presenceRenderer.render(item, mediaType, state, 60000, "Library", lambda: item.guids)
+			def render() -> None:
+				for i in range(iterations):
+					presenceRenderer.render(item, mediaType, "paused" if i % 2 else "playing", 60000, "Library", lambda: item.guids)
+			results.append(iterations / timeCall(render, 3) * 1000)
+		print(f"{mediaType:>12} | {results[0]:>20.0f} | {results[1]:>20.0f}")
+
+class FakePlexServer:
+
+	def __init__(self) -> None:
+		import http.server
+		self.items: dict[int, tuple[str, str, str]] = {}
+		self.sessions: dict[int, tuple[int, str]] = {}
+		self.requests: dict[str, int] = {}
+		self.requestsLock = threading.Lock()
+		self.rejectWebSockets = False
+		fakePlexServer = self
+		class RequestHandler(http.server.BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+			disable_nagle_algorithm = True
+			def do_GET(self) -> None:
+				path = self.path.split("?")[0]
+				if path == "/:/websockets/notifications" and not fakePlexServer.rejectWebSockets:
+					fakePlexServer.handleWebSocket(self)
+					return
+				status, body = fakePlexServer.handleRequest(path)
+				bodyBytes = body.encode("utf-8")
+				self.send_response(status)
+				self.send_header("Content-Type", "text/xml;charset=utf-8")
+				self.send_header("Content-Length", str(len(bodyBytes)))
+				self.end_headers()
+				self.wfile.write(bodyBytes)
+			def log_message(self, format: str, *args: object) -> None:
+				pass
+		self.httpServer = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+		self.httpServer.daemon_threads = True
+		self.url = f"http://127.0.0.1:{self.httpServer.server_address[1]}"
+		threading.Thread(target = self.httpServer.serve_forever, daemon = True).start()
+
+	def addMovie(self, ratingKey: int) -> None:
+		self.items[ratingKey] = ("Video", f'ratingKey="{ratingKey}" key="/library/metadata/{ratingKey}" type="movie" title="Movie {ratingKey}" year="2000" librarySectionID="1" thumb="/library/metadata/{ratingKey}/thumb/1" duration="7200000"', f'<Director tag="Director"/><Guid id="imdb://tt{ratingKey:07}"/>')
+
+	def addEpisode(self, ratingKey: int, showRatingKey: int, index: int) -> None:
+		self.items[ratingKey] = ("Video", f'ratingKey="{ratingKey}" key="/library/metadata/{ratingKey}" type="episode" title="Episode {index}" grandparentTitle="Show" grandparentRatingKey="{showRatingKey}" grandparentThumb="/library/metadata/{showRatingKey}/thumb/1" parentIndex="1" index="{index}" librarySectionID="2" duration="2400000"', "")
+		self.items.setdefault(showRatingKey, ("Directory", f'ratingKey="{showRatingKey}" key="/library/metadata/{showRatingKey}/children" type="show" title="Show" librarySectionID="2"', f'<Guid id="tmdb://{showRatingKey}"/>'))
+
+	def addTrack(self, ratingKey: int) -> None:
+		self.items[ratingKey] = ("Track", f'ratingKey="{ratingKey}" key="/library/metadata/{ratingKey}" type="track" title="Track {ratingKey}" parentTitle="Album" grandparentTitle="Artist" librarySectionID="3" thumb="/library/metadata/{ratingKey}/thumb/1" duration="240000"', "")
+
+	def renderItem(self, ratingKey: int, extraAttributes: str = "", extraChildren: str = "") -> str:
+		tag, attributes, children = self.items[ratingKey]
+		return f"<{tag} {attributes}{extraAttributes}>{children}{extraChildren}</{tag}>"
+
+	def handleRequest(self, path: str) -> tuple[int, str]:
+		with self.requestsLock:
+			endpoint = "/library/metadata" if path.startswith("/library/metadata/") else path
+			self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+		if path == "/":
+			return 200, '<MediaContainer friendlyName="Benchmark" machineIdentifier="benchmark" version="1.40.0.0" myPlexUsername="user"/>'
+		if path == "/myplex/account":
+			return 200, '<MyPlex authToken="benchmark" username="user" signInState="ok" mappingState="mapped"/>'
+		if path == "/library":
+			return 200, '<MediaContainer title1="Plex Library"/>'
+		if path == "/library/sections":
+			return 200, '<MediaContainer><Directory key="1" type="movie" title="Movies"/><Directory key="2" type="show" title="TV Shows"/><Directory key="3" type="artist" title="Music"/></MediaContainer>'
+		if path == "/status/sessions":
+			sessions = "".join(self.renderItem(ratingKey, f' sessionKey="{sessionKey}"', f'<User id="{sessionKey}" title="{username}"/>') for sessionKey, (ratingKey, username) in self.sessions.items())
+			return 200, f'<MediaContainer size="{len(self.sessions)}">{sessions}</MediaContainer>'
+		if path.startswith("/library/metadata/"):
+			ratingKey = int(path.split("/")[3])
+			if ratingKey not in self.items:
+				self.addMovie(ratingKey)
+			return 200, f"<MediaContainer>{self.renderItem(ratingKey)}</MediaContainer>"
+		return 404, "<MediaContainer/>"
+
+	def handleWebSocket(self, requestHandler: Any) -> None:
+		from utils.websocket import WebSocketConnection, WebSocketOpcode
+		import base64
+		import hashlib
+		with self.requestsLock:
+			self.requests["/:/websockets/notifications"] = self.requests.get("/:/websockets/notifications", 0) + 1
+		accept = base64.b64encode(hashlib.sha1((requestHandler.headers["Sec-WebSocket-Key"] + WebSocketConnection.acceptGuid).encode("ascii")).digest()).decode("ascii")
+		requestHandler.send_response(101)
+		requestHandler.send_header("Upgrade", "websocket")
+		requestHandler.send_header("Connection", "Upgrade")
+		requestHandler.send_header("Sec-WebSocket-Accept", accept)
+		requestHandler.end_headers()
+		requestHandler.wfile.flush()
+		requestHandler.close_connection = True
+		try:
+			while True:
+				header = requestHandler.rfile.read(2)
+				if len(header) < 2:
+					return
+				opcode, length = header[0] & 0x0F, header[1] & 0x7F
+				if length == 126:
+					length = struct.unpack("!H", requestHandler.rfile.read(2))[0]
+				elif length == 127:
+					length = struct.unpack("!Q", requestHandler.rfile.read(8))[0]
+				mask = requestHandler.rfile.read(4) if header[1] & 0x80 else b""
+				payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(requestHandler.rfile.read(length))) if mask else requestHandler.rfile.read(length)
+				if opcode == WebSocketOpcode.PING:
+					requestHandler.wfile.write(struct.pack("!BB", 0x80 | WebSocketOpcode.PONG, len(payload)) + payload)
+				elif opcode == WebSocketOpcode.CLOSE:
+					requestHandler.wfile.write(struct.pack("!BB", 0x80 | WebSocketOpcode.CLOSE, 0))
+					return
+		except OSError:
+			pass
+
+	def stop(self) -> None:
+		self.httpServer.shutdown()
+
+def createStateAlert(sessionKey: int, ratingKey: int, state: str, viewOffset: int) -> Any:
+	return { "type": "playing", "size": 1, "PlaySessionStateNotification": [{ "sessionKey": str(sessionKey), "ratingKey": str(ratingKey), "key": f"/library/metadata/{ratingKey}", "state": state, "viewOffset": viewOffset }] }
+
+def createAlertStream(fakePlexServer: FakePlexServer) -> list[Any]:
+	alerts: list[Any] = []
+	otherAlerts: list[Any] = []
+	fakePlexServer.addMovie(1)
+	fakePlexServer.sessions[1] = (1, "user")
+	viewOffset = 0
+	for state, ticks in [("playing", 60), ("paused", 5), ("playing", 20)]:
+		for _ in range(ticks):
+			viewOffset += 10000 if state == "playing" else 0
+			alerts.append(createStateAlert(1, 1, state, viewOffset))
+	alerts.append(createStateAlert(1, 1, "stopped", viewOffset))
+	for index in range(1, 6):
+		fakePlexServer.addEpisode(10 + index, 10, index)
+		fakePlexServer.sessions[2] = (10 + index, "user")
+		for tick in range(20):
+			alerts.append(createStateAlert(2, 10 + index, "playing", tick * 10000))
+		alerts.append({ "type": "timeline", "size": 1, "TimelineEntry": [{ "identifier": "com.plexapp.plugins.library", "itemID": str(10 + index), "type": 4, "state": 5 }] })
+	alerts.append(createStateAlert(2, 15, "stopped", 190000))
+	for ratingKey in range(21, 31):
+		fakePlexServer.addTrack(ratingKey)
+		fakePlexServer.sessions[3] = (ratingKey, "user")
+		for tick in range(8):
+			alerts.append(createStateAlert(3, ratingKey, "playing", tick * 10000))
+	fakePlexServer.addTrack(100)
+	fakePlexServer.sessions[4] = (100, "other")
+	for tick in range(len(alerts) // 3):
+		otherAlerts.append(createStateAlert(4, 100, "playing", tick * 10000))
+	mergedAlerts: list[Any] = []
+	for i, alert in enumerate(alerts):
+		mergedAlerts.append(alert)
+		if i % 3 == 0 and i // 3 < len(otherAlerts):
+			mergedAlerts.append(otherAlerts[i // 3])
+	return mergedAlerts
+
+def getRss() -> float:
+	try:
+		with open("/proc/self/statm", "r") as statmFile:
+			return int(statmFile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+	except OSError:
+		import resource
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def benchmarkReplay() -> None:
+	from concurrent.futures import Future
+	from core.plex import PlexAlertListener
+	from plexapi.server import PlexServer
+	from utils.metrics import getCounter
+	fakePlexServer = FakePlexServer()
+	alerts = createAlertStream(fakePlexServer)
+	if len(sys.argv) > 2:
+		with open(sys.argv[2], "r", encoding = "UTF-8") as alertsFile:
+			alerts = json.load(alertsFile)
+		for alert in alerts:
+			for stateNotification in alert.get("PlaySessionStateNotification", []):
+				ratingKey = int(stateNotification["ratingKey"])
+				if ratingKey not in fakePlexServer.items:
+					fakePlexServer.addMovie(ratingKey)
+				fakePlexServer.sessions.setdefault(int(stateNotification["sessionKey"]), (ratingKey, "user"))
+	fakeDiscordServer = FakeDiscordServer(os.path.join(os.getcwd(), "discord-ipc-0"))
+	loop = asyncio.new_event_loop()
+	threading.Thread(target = loop.run_forever, daemon = True).start()
+	plexAlertListener = PlexAlertListener("benchmark", { "name": "Benchmark", "ipcPipeNumber": 0 }, loop)
+	discordIpcService = plexAlertListener.discordIpcClient.service
+	discordIpcService.pipes = [fakeDiscordServer.path]
+	discordIpcService.activityRateLimit = discordIpcService.activityTokens = sys.maxsize
+	latencies: list[float] = []
+	futures: list[Future[None]] = []
+	def timeActivityUpdates(updateActivity: Callable[..., Future[None]]) -> Callable[..., Future[None]]:
+		def timedUpdateActivity(activity: Any, requestedAt: Optional[float] = None) -> Future[None]:
+			future = updateActivity(activity, requestedAt)
+			if requestedAt is not None:
+				future.add_done_callback(lambda _: latencies.append((time.perf_counter() - requestedAt) * 1000))
+			futures.append(future)
+			return future
+		return timedUpdateActivity
+	plexAlertListener.discordIpcClient.setActivity = timeActivityUpdates(plexAlertListener.discordIpcClient.setActivity) # pyright: ignore[reportAttributeAccessIssue]
+	plexAlertListener.discordIpcClient.refreshActivity = timeActivityUpdates(plexAlertListener.discordIpcClient.refreshActivity) # pyright: ignore[reportAttributeAccessIssue]
+	rssBefore = getRss()
+	plexAlertListener.setServer(PlexServer(fakePlexServer.url, "benchmark"))
+	plexAlertListener.listenForUser = "user"
+	fakePlexServer.requests.clear()
+	startTime = time.perf_counter()
+	for alert in alerts:
+		plexAlertListener.tryHandleAlert(alert)
+	handledAt = time.perf_counter()
+	for future in list(futures):
+		future.result()
+	elapsed = time.perf_counter() - startTime
+	httpCalls = sum(fakePlexServer.requests.values())
+	print(f"Alerts: {len(alerts)} ({getCounter('alerts_received_total'):.0f} playing, {getCounter('alerts_short_circuited_total'):.0f} short-circuited)")
+	print(f"Throughput: {len(alerts) / (handledAt - startTime):.0f} alerts/s handled, {len(alerts) / elapsed:.0f} alerts/s including delivery to Discord")
+	print(f"HTTP calls: {httpCalls} ({httpCalls / len(alerts):.3f} per alert; {', '.join(f'{endpoint}: {count}' for endpoint, count in sorted(fakePlexServer.requests.items()))})")
+	print(f"Discord activity updates: {getCounter('discord_activity_updates_sent_total'):.0f} sent, {getCounter('discord_activity_updates_coalesced_total'):.0f} coalesced, {getCounter('discord_activity_updates_skipped_total'):.0f} skipped")
+	print(f"End-to-end latency (ms): {formatPercentiles(latencies)}")
+	print(f"RSS: {rssBefore:.1f} MiB before, {getRss():.1f} MiB after")
+	plexAlertListener.stop()
+	fakePlexServer.stop()
+
+def runRuntime(runtime: str, url: str, serverCount: int, idleDuration: float, results: "multiprocessing.Queue[tuple[int, int, float, float]]") -> None:
+	from core import plex
+	from types import SimpleNamespace
+	from utils.cache import loadCache
+	import resource
+	logger.setLevel(logging.WARNING)
+	loadCache()
+	def createResource(serverName: str) -> Any:
+		return SimpleNamespace(product = plex.PlexAlertListener.productName, name = serverName, clientIdentifier = serverName, accessToken = "benchmark", connections = [], preferred_connections = lambda: [url, "http://127.0.0.1:9"])
+	serverNames = [f"Benchmark {i}" for i in range(serverCount)]
+	plex.accountCache["benchmark"] = (SimpleNamespace(username = "user"), [createResource(serverName) for serverName in serverNames], time.monotonic() + 3600) # pyright: ignore[reportArgumentType]
+	peakThreads = threading.active_count()
+	plexAlertListeners: list[Any] = []
+	if runtime == "asyncio":
+		from core.runtime import AsyncRuntime
+		asyncRuntime = AsyncRuntime()
+		asyncRuntime.start()
+		plexAlertListeners = [asyncRuntime.createListener("benchmark", { "name": serverName }) for serverName in serverNames]
+	else:
+		plexAlertListeners = [plex.PlexAlertListener("benchmark", { "name": serverName }) for serverName in serverNames]
+	deadline = time.monotonic() + 60
+	while any(plexAlertListener.connectionState != "connected" for plexAlertListener in plexAlertListeners) and time.monotonic() < deadline:
+		peakThreads = max(peakThreads, threading.active_count())
+		time.sleep(0.01)
+	time.sleep(1)
+	idleThreads = threading.active_count()
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	cpuTime = usage.ru_utime + usage.ru_stime
+	time.sleep(idleDuration)
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	idleCpu = (usage.ru_utime + usage.ru_stime - cpuTime) / idleDuration * 1000
+	results.put((max(peakThreads, idleThreads), idleThreads, idleCpu, getRss()))
+
+def benchmarkRuntime() -> None:
+	fakePlexServer = FakePlexServer()
+	idleDuration = float(os.environ.get("BENCHMARK_IDLE_DURATION", 35))
+	context = multiprocessing.get_context("spawn")
+	print(f"Idle measurements over {idleDuration:.0f} s, including WebSocket pings")
+	print(f"{'runtime':>8} | {'servers':>7} | {'peak threads':>12} | {'idle threads':>12} | {'idle CPU (ms/s)':>15} | {'RSS (MiB)':>9}")
+	for serverCount in [1, 10, 50]:
+		for runtime in ["threaded", "asyncio"]:
+			results: "multiprocessing.Queue[tuple[int, int, float, float]]" = context.Queue()
+			process = context.Process(target = runRuntime, args = (runtime, fakePlexServer.url, serverCount, idleDuration, results))
+			process.start()
+			peakThreads, idleThreads, idleCpu, rss = results.get()
+			process.join()
+			print(f"{runtime:>8} | {serverCount:>7} | {peakThreads:>12} | {idleThreads:>12} | {idleCpu:>15.3f} | {rss:>9.1f}")
+	fakePlexServer.stop()
+
+modes: dict[str, Callable[[], None]] = {
+	"cache": benchmarkCache,
+	"poster": benchmarkPoster,
+	"ipc": benchmarkIpc,
+	"ipc-frames": benchmarkIpcFrames,
+	"presence": benchmarkPresence,
+	"replay": benchmarkReplay,
+	"runtime": benchmarkRuntime,
+}
+
+if __name__ == "__main__":
+	mode = sys.argv[1] if len(sys.argv) > 1 else ""
+	if mode not in modes:
+		print(f"Usage: python {sys.argv[0]} <{'|'.join(modes)}>")
+		exit(1)
+	logger.setLevel(logging.WARNING)
+	sys.argv[2:] = [os.path.abspath(argument) for argument in sys.argv[2:]]
+	with tempfile.TemporaryDirectory() as temporaryDirectory:
+		os.makedirs(os.path.join(temporaryDirectory, "data"))
+		os.chdir(temporaryDirectory)
+		modes[mode]()
@@ -0,0 +1,54 @@
+from .logging import logger
+from .metrics import incrementCounter
+import random
+import threading
+import time
+
+class CircuitState:
+	CLOSED = "closed"
+	OPEN = "open"
+	HALF_OPEN = "half_open"
+
+class Backoff:
+
+	def __init__(self, name: str, baseDelay: float = 5, maximumDelay: float = 300, failureThreshold: int = 8, openDuration: float = 900) -> None:
+		self.name = name
+		self.baseDelay = baseDelay
+		self.maximumDelay = maximumDelay
+		self.failureThreshold = failureThreshold
+		self.openDuration = openDuration
+		self.state = CircuitState.CLOSED
+		self.failures = 0
+		self.openUntil = 0.0
+		self.lock = threading.Lock()
+
+	def transition(self, state: str) -> None:
+		if self.state == state:
+			return
+		logger.debug("Circuit '%s' changed from %s to %s", self.name, self.state, state)
+		self.state = state
+		incrementCounter("circuit_state_transitions_total", labels = { "circuit": self.name, "state": state })
+
+	def getWaitTime(self) -> float:
+		with self.lock:
+			if self.state != CircuitState.OPEN:
+				return 0
+			remaining = self.openUntil - time.monotonic()
+			if remaining > 0:
+				return remaining + random.uniform(0, self.baseDelay)
+			self.transition(CircuitState.HALF_OPEN)
+			return 0
+
+	def recordSuccess(self) -> None:
+		with self.lock:
+			self.failures = 0
+			self.transition(CircuitState.CLOSED)
+
+	def recordFailure(self) -> float:
+		with self.lock:
+			self.failures += 1
+			if self.state == CircuitState.HALF_OPEN or self.failures >= self.failureThreshold:
+				self.openUntil = time.monotonic() + self.openDuration
+				self.transition(CircuitState.OPEN)
+				return self.openDuration + random.uniform(0, self.baseDelay)
+			return random.uniform(self.baseDelay, min(self.maximumDelay, self.baseDelay * 2 ** self.failures))
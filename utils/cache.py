@@ -1,30 +1,276 @@
 from .logging import logger
-from config.constants import cacheFilePath
-from typing import Any
+from .scheduler import ScheduledTask, scheduler
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from config.constants import cacheFilePath, cacheDatabaseFilePath
+from typing import Any, Optional
 import json
 import os
+import sqlite3
+import threading
 import time
 
-cache: dict[str, Any] = {}
+class CacheStorage(ABC):
 
-def loadCache() -> None:
-	if not os.path.isfile(cacheFilePath):
-		return
+	def __init__(self, maxEntries: int = 0, ttl: float = 0) -> None:
+		self.maxEntries = maxEntries
+		self.ttl = ttl
+
+	def isExpired(self, createdAt: float) -> bool:
+		return self.ttl > 0 and createdAt + self.ttl < time.time()
+
+	def load(self) -> None:
+		pass
+
+	@abstractmethod
+	def get(self, key: str) -> Any:
+		...
+
+	@abstractmethod
+	def set(self, key: str, value: Any) -> None:
+		...
+
+	def flush(self) -> None:
+		pass
+
+	def close(self) -> None:
+		self.flush()
+
+class JsonCacheStorage(CacheStorage):
+
+	version = 2
+	flushInterval = 10
+	flushThreshold = 50
+
+	def __init__(self, maxEntries: int = 0, ttl: float = 0, filePath: str = cacheFilePath) -> None:
+		super().__init__(maxEntries, ttl)
+		self.filePath = filePath
+		self.entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+		self.lock = threading.Lock()
+		self.dirtyKeys: set[str] = set()
+		self.flushLock = threading.Lock()
+		self.flushTask: Optional[ScheduledTask] = None
+
+	def load(self) -> None:
+		self.flushTask = scheduler.schedule(self.flushInterval, self.periodicFlush)
+		self.readFile()
+
+	def readFile(self) -> None:
+		loadedCache = self.parseFile()
+		if loadedCache is None:
+			return
+		with self.lock:
+			if self.importEntries(loadedCache):
+				logger.info("Migrating the cache file to version %s", self.version)
+				self.dirtyKeys.update(self.entries)
+			self.evict()
+
+	def parseFile(self) -> Any:
+		if not os.path.isfile(self.filePath):
+			return None
+		try:
+			with open(self.filePath, "r", encoding = "UTF-8") as cacheFile:
+				return json.load(cacheFile)
+		except:
+			root, ext = os.path.splitext(self.filePath)
+			os.rename(self.filePath, f"{root}-{time.time():.0f}{ext}")
+			logger.exception("Failed to parse the cache file. A new one will be created.")
+			return None
+
+	def importEntries(self, loadedCache: Any) -> bool:
+		if not isinstance(loadedCache, dict):
+			logger.warning("Discarding the cache file as its format is not recognised")
+		elif "version" not in loadedCache:
+			currentTime = time.time()
+			for key, value in loadedCache.items():
+				self.entries[key] = (value, currentTime)
+			return True
+		elif loadedCache["version"] == self.version:
+			for key, (value, createdAt) in loadedCache["entries"].items():
+				if not self.isExpired(createdAt):
+					self.entries[key] = (value, createdAt)
+		else:
+			logger.warning("Discarding the cache file as its version (%s) is not supported", loadedCache["version"])
+		return False
+
+	def get(self, key: str) -> Any:
+		with self.lock:
+			entry = self.entries.get(key)
+			if not entry:
+				return None
+			if self.isExpired(entry[1]):
+				del self.entries[key]
+				self.dirtyKeys.add(key)
+				return None
+			self.entries.move_to_end(key)
+			return entry[0]
+
+	def set(self, key: str, value: Any) -> None:
+		with self.lock:
+			self.entries[key] = (value, time.time())
+			self.entries.move_to_end(key)
+			self.dirtyKeys.add(key)
+			self.evict()
+			shouldFlush = len(self.dirtyKeys) >= self.flushThreshold
+		if shouldFlush:
+			scheduler.schedule(0, self.flush)
+
+	def evict(self) -> None:
+		while self.maxEntries > 0 and len(self.entries) > self.maxEntries:
+			key, _ = self.entries.popitem(last = False)
+			self.dirtyKeys.add(key)
+
+	def flush(self) -> None:
+		with self.flushLock:
+			with self.lock:
+				if not self.dirtyKeys:
+					return
+				flushedKeys = set(self.dirtyKeys)
+				self.dirtyKeys.clear()
+				snapshot = { "version": self.version, "entries": dict(self.entries) }
+			try:
+				self.writeFile(snapshot)
+			except:
+				with self.lock:
+					self.dirtyKeys.update(flushedKeys)
+				logger.exception("Failed to write to the cache file")
+
+	def writeFile(self, snapshot: dict[str, Any]) -> None:
+		temporaryFilePath = f"{self.filePath}.tmp"
+		with open(temporaryFilePath, "w", encoding = "UTF-8") as cacheFile:
+			json.dump(snapshot, cacheFile, separators = (",", ":"))
+			cacheFile.flush()
+			os.fsync(cacheFile.fileno())
+		os.replace(temporaryFilePath, self.filePath)
+
+	def periodicFlush(self) -> None:
+		self.flush()
+		self.flushTask = scheduler.schedule(self.flushInterval, self.periodicFlush)
+
+	def close(self) -> None:
+		if self.flushTask:
+			self.flushTask.cancel()
+			self.flushTask = None
+		self.flush()
+
+class SqliteCacheStorage(CacheStorage):
+
+	accessUpdateInterval = 60
+
+	def __init__(self, maxEntries: int = 0, ttl: float = 0, filePath: str = cacheDatabaseFilePath) -> None:
+		super().__init__(maxEntries, ttl)
+		self.filePath = filePath
+		self.lock = threading.Lock()
+		self.connection: Optional[sqlite3.Connection] = None
+		self.entryCount = 0
+
+	def load(self) -> None:
+		shouldMigrate = not os.path.isfile(self.filePath) and os.path.isfile(cacheFilePath)
+		self.connection = sqlite3.connect(self.filePath, check_same_thread = False)
+		self.connection.execute("PRAGMA journal_mode = WAL")
+		self.connection.execute("PRAGMA synchronous = NORMAL")
+		self.connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, createdAt REAL NOT NULL, accessedAt REAL NOT NULL)")
+		self.connection.execute("CREATE INDEX IF NOT EXISTS cacheAccessedAt ON cache (accessedAt)")
+		if shouldMigrate:
+			self.migrate()
+		with self.lock:
+			if self.ttl > 0:
+				self.connection.execute("DELETE FROM cache WHERE createdAt < ?", (time.time() - self.ttl,))
+			self.entryCount = self.connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+			self.evict()
+			self.connection.commit()
+
+	def migrate(self) -> None:
+		assert self.connection
+		logger.info("Migrating the cache file to %s", self.filePath)
+		jsonCacheStorage = JsonCacheStorage(filePath = cacheFilePath)
+		loadedCache = jsonCacheStorage.parseFile()
+		if loadedCache is None:
+			return
+		jsonCacheStorage.importEntries(loadedCache)
+		with self.lock:
+			self.connection.executemany(
+				"INSERT OR REPLACE INTO cache (key, value, createdAt, accessedAt) VALUES (?, ?, ?, ?)",
+				[(key, json.dumps(value), createdAt, createdAt) for key, (value, createdAt) in jsonCacheStorage.entries.items()],
+			)
+			self.connection.commit()
+		root, ext = os.path.splitext(cacheFilePath)
+		os.rename(cacheFilePath, f"{root}-migrated{ext}")
+
+	def get(self, key: str) -> Any:
+		if not self.connection:
+			return None
+		with self.lock:
+			row = self.connection.execute("SELECT value, createdAt, accessedAt FROM cache WHERE key = ?", (key,)).fetchone()
+			if not row:
+				return None
+			value, createdAt, accessedAt = row
+			currentTime = time.time()
+			if self.isExpired(createdAt):
+				self.connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+				self.connection.commit()
+				self.entryCount -= 1
+				return None
+			if self.maxEntries > 0 and accessedAt + self.accessUpdateInterval < currentTime:
+				self.connection.execute("UPDATE cache SET accessedAt = ? WHERE key = ?", (currentTime, key))
+				self.connection.commit()
+		return json.loads(value)
+
+	def set(self, key: str, value: Any) -> None:
+		if not self.connection:
+			return
+		currentTime = time.time()
+		with self.lock:
+			try:
+				cursor = self.connection.execute("UPDATE cache SET value = ?, createdAt = ?, accessedAt = ? WHERE key = ?", (json.dumps(value), currentTime, currentTime, key))
+				if cursor.rowcount == 0:
+					self.connection.execute("INSERT INTO cache (key, value, createdAt, accessedAt) VALUES (?, ?, ?, ?)", (key, json.dumps(value), currentTime, currentTime))
+					self.entryCount += 1
+					self.evict()
+				self.connection.commit()
+			except:
+				self.connection.rollback()
+				logger.exception("Failed to write to the cache database")
+
+	def evict(self) -> None:
+		assert self.connection
+		if self.maxEntries <= 0 or self.entryCount <= self.maxEntries:
+			return
+		self.connection.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessedAt LIMIT ?)", (self.entryCount - self.maxEntries,))
+		self.entryCount = self.maxEntries
+
+	def close(self) -> None:
+		with self.lock:
+			if self.connection:
+				self.connection.close()
+				self.connection = None
+
+cacheStorageTypes: dict[str, type[CacheStorage]] = {
+	"json": JsonCacheStorage,
+	"sqlite": SqliteCacheStorage,
+}
+cacheStorage: CacheStorage = JsonCacheStorage()
+
+def loadCache(backend: str = "json", maxEntries: int = 0, ttl: float = 0) -> None:
+	global cacheStorage
+	cacheStorageType = cacheStorageTypes.get(backend)
+	if not cacheStorageType:
+		logger.warning("Unknown cache backend '%s', falling back to 'json'", backend)
+		cacheStorageType = JsonCacheStorage
+	cacheStorage = cacheStorageType(maxEntries, ttl)
 	try:
-		with open(cacheFilePath, "r", encoding = "UTF-8") as cacheFile:
-			cache.update(json.load(cacheFile))
+		cacheStorage.load()
 	except:
-		root, ext = os.path.splitext(cacheFilePath)
-		os.rename(cacheFilePath, f"{root}-{time.time():.0f}.{ext}")
-		logger.exception("Failed to parse the cache file. A new one will be created.")
+		logger.exception("Failed to load the cache")
 
 def getCacheKey(key: str) -> Any:
-	return cache.get(key)
+	return cacheStorage.get(key)
 
 def setCacheKey(key: str, value: Any) -> None:
-	cache[key] = value
-	try:
-		with open(cacheFilePath, "w", encoding = "UTF-8") as cacheFile:
-			json.dump(cache, cacheFile, separators = (",", ":"))
-	except:
-		logger.exception("Failed to write to the cache file")
+	cacheStorage.set(key, value)
+
+def flushCache() -> None:
+	cacheStorage.flush()
+
+def closeCache() -> None:
+	cacheStorage.close()
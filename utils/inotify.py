@@ -0,0 +1,55 @@
+from typing import Any, Optional
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+eventHeaderFormat = "iIII"
+eventHeaderSize = struct.calcsize(eventHeaderFormat)
+
+libc: Optional[Any] = None
+if sys.platform == "linux":
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+		libc.inotify_init1.argtypes = [ctypes.c_int]
+		libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+	except (OSError, AttributeError):
+		libc = None
+isInotifySupported = libc is not None
+
+class DirectoryWatcher:
+
+	def __init__(self, directoryPaths: list[str]) -> None:
+		assert libc
+		self.fd: int = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+		self.directoryPaths: dict[int, str] = {}
+		for directoryPath in directoryPaths:
+			watchDescriptor: int = libc.inotify_add_watch(self.fd, os.fsencode(directoryPath), IN_CREATE | IN_MOVED_TO)
+			if watchDescriptor >= 0:
+				self.directoryPaths[watchDescriptor] = directoryPath
+
+	def readCreatedPaths(self) -> list[str]:
+		try:
+			data = os.read(self.fd, 65536)
+		except BlockingIOError:
+			return []
+		createdPaths: list[str] = []
+		position = 0
+		while position + eventHeaderSize <= len(data):
+			watchDescriptor, _, _, length = struct.unpack_from(eventHeaderFormat, data, position)
+			name = data[position + eventHeaderSize:position + eventHeaderSize + length].rstrip(b"\0")
+			position += eventHeaderSize + length
+			if name and watchDescriptor in self.directoryPaths:
+				createdPaths.append(os.path.join(self.directoryPaths[watchDescriptor], os.fsdecode(name)))
+		return createdPaths
+
+	def close(self) -> None:
+		os.close(self.fd)
@@ -1,9 +1,42 @@
 from config.constants import name
-from typing import Any, Callable
+from typing import Any, Callable, Optional
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+class DebugRateLimitFilter(logging.Filter):
+
+	def __init__(self, limit: int = 20, period: float = 60) -> None:
+		super().__init__()
+		self.limit = limit
+		self.period = period
+		# message template -> [window start, records emitted, records suppressed]
+		self.windows: dict[str, list[float]] = {}
+		self.lock = threading.Lock()
+
+	def filter(self, record: logging.LogRecord) -> bool:
+		if record.levelno != logging.DEBUG:
+			return True
+		key = str(record.msg)
+		currentTime = time.monotonic()
+		with self.lock:
+			window = self.windows.get(key)
+			if not window or currentTime - window[0] >= self.period:
+				self.windows[key] = [currentTime, 1, 0]
+				if window and window[2]:
+					record.msg = f"{record.msg} ({window[2]:.0f} similar messages suppressed)"
+				return True
+			if window[1] < self.limit:
+				window[1] += 1
+				return True
+			window[2] += 1
+			return False
 
 logger = logging.getLogger(name)
 logger.setLevel(logging.INFO)
+logger.addFilter(DebugRateLimitFilter())
 formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s", datefmt = "%d-%m-%Y %I:%M:%S %p")
 streamHandler = logging.StreamHandler()
 streamHandler.setFormatter(formatter)
@@ -13,13 +46,31 @@ class LoggerWithPrefix:
 
 	def __init__(self, prefix: str) -> None:
 		self.prefix = prefix
-		self.info = self.wrapLoggerFunc(logger.info)
-		self.warning = self.wrapLoggerFunc(logger.warning)
-		self.error = self.wrapLoggerFunc(logger.error)
-		self.exception = self.wrapLoggerFunc(logger.exception)
-		self.debug = self.wrapLoggerFunc(logger.debug)
+		self.info = self.wrapLoggerFunc(logger.info, logging.INFO)
+		self.warning = self.wrapLoggerFunc(logger.warning, logging.WARNING)
+		self.error = self.wrapLoggerFunc(logger.error, logging.ERROR)
+		self.exception = self.wrapLoggerFunc(logger.exception, logging.ERROR)
+		self.debug = self.wrapLoggerFunc(logger.debug, logging.DEBUG)
 
-	def wrapLoggerFunc(self, func: Callable[..., None]) -> Callable[..., None]:
+	def wrapLoggerFunc(self, func: Callable[..., None], level: int) -> Callable[..., None]:
 		def wrappedFunc(obj: Any, *args: Any, **kwargs: Any) -> None:
-			func(self.prefix + str(obj), *args, **kwargs)
+			if logger.isEnabledFor(level):
+				func(self.prefix + str(obj), *args, **kwargs)
 		return wrappedFunc
+
+queueListener: Optional[logging.handlers.QueueListener] = None
+
+def startFileLogging(filePath: str, maxFileSize: int, backupCount: int) -> None:
+	global queueListener
+	fileHandler = logging.handlers.RotatingFileHandler(filePath, maxBytes = maxFileSize * 1024 * 1024, backupCount = backupCount, encoding = "UTF-8")
+	fileHandler.setFormatter(formatter)
+	logQueue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+	queueListener = logging.handlers.QueueListener(logQueue, fileHandler)
+	queueListener.start()
+	logger.addHandler(logging.handlers.QueueHandler(logQueue))
+
+def stopFileLogging() -> None:
+	global queueListener
+	if queueListener:
+		queueListener.stop()
+		queueListener = None
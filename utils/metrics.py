@@ -0,0 +1,108 @@
+from .logging import logger
+from typing import Callable, Optional
+import bisect
+import http.server
+import threading
+
+Labels = tuple[tuple[str, str], ...]
+
+defaultBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+counters: dict[str, dict[Labels, float]] = {}
+histograms: dict[str, tuple[tuple[float, ...], dict[Labels, list[float]]]] = {}
+gauges: dict[str, Callable[[], float]] = {}
+metricsLock = threading.Lock()
+
+def toLabels(labels: Optional[dict[str, str]]) -> Labels:
+	return tuple(sorted(labels.items())) if labels else ()
+
+def incrementCounter(name: str, amount: float = 1, labels: Optional[dict[str, str]] = None) -> None:
+	key = toLabels(labels)
+	with metricsLock:
+		series = counters.setdefault(name, {})
+		series[key] = series.get(key, 0) + amount
+
+def getCounter(name: str, labels: Optional[dict[str, str]] = None) -> float:
+	with metricsLock:
+		series = counters.get(name, {})
+		if labels is None:
+			return sum(series.values())
+		return series.get(toLabels(labels), 0)
+
+def getRatio(hitsName: str, missesName: str) -> float:
+	hits, misses = getCounter(hitsName), getCounter(missesName)
+	return hits / (hits + misses) if hits + misses else 0
+
+def observeHistogram(name: str, value: float, labels: Optional[dict[str, str]] = None, buckets: tuple[float, ...] = defaultBuckets) -> None:
+	key = toLabels(labels)
+	with metricsLock:
+		bucketBounds, series = histograms.setdefault(name, (buckets, {}))
+		# per-bucket counts followed by the sum and the count of observations
+		values = series.setdefault(key, [0.0] * (len(bucketBounds) + 2))
+		bucketIndex = bisect.bisect_left(bucketBounds, value)
+		if bucketIndex < len(bucketBounds):
+			values[bucketIndex] += 1
+		values[-2] += value
+		values[-1] += 1
+
+def registerGauge(name: str, getValue: Callable[[], float]) -> None:
+	with metricsLock:
+		gauges[name] = getValue
+
+def escapeLabelValue(value: str) -> str:
+	return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def formatLabels(labels: Labels) -> str:
+	if not labels:
+		return ""
+	return "{" + ",".join(f'{key}="{escapeLabelValue(value)}"' for key, value in labels) + "}"
+
+def formatValue(value: float) -> str:
+	return str(int(value)) if value == int(value) else repr(value)
+
+def renderMetrics() -> str:
+	lines: list[str] = []
+	with metricsLock:
+		for name, series in sorted(counters.items()):
+			lines.append(f"# TYPE {name} counter")
+			lines.extend(f"{name}{formatLabels(labels)} {formatValue(value)}" for labels, value in series.items())
+		for name, (bucketBounds, series) in sorted(histograms.items()):
+			lines.append(f"# TYPE {name} histogram")
+			for labels, values in series.items():
+				cumulativeCount = 0.0
+				for bucketBound, bucketCount in zip(bucketBounds, values):
+					cumulativeCount += bucketCount
+					lines.append(f"{name}_bucket{formatLabels(labels + (('le', formatValue(bucketBound)),))} {formatValue(cumulativeCount)}")
+				lines.append(f"{name}_bucket{formatLabels(labels + (('le', '+Inf'),))} {formatValue(values[-1])}")
+				lines.append(f"{name}_sum{formatLabels(labels)} {formatValue(values[-2])}")
+				lines.append(f"{name}_count{formatLabels(labels)} {formatValue(values[-1])}")
+		gaugeItems = sorted(gauges.items())
+	for name, getValue in gaugeItems:
+		lines.append(f"# TYPE {name} gauge")
+		lines.append(f"{name} {formatValue(getValue())}")
+	return "\n".join(lines) + "\n"
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+
+	def do_GET(self) -> None:
+		if self.path.split("?")[0] != "/metrics":
+			self.send_error(404)
+			return
+		body = renderMetrics().encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format: str, *args: object) -> None:
+		pass
+
+def startMetricsServer(host: str, port: int) -> http.server.ThreadingHTTPServer:
+	metricsServer = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+	metricsServer.daemon_threads = True
+	threading.Thread(target = metricsServer.serve_forever, name = "MetricsServer", daemon = True).start()
+	logger.info("Serving metrics at http://%s:%s/metrics", host, port)
+	return metricsServer
+
+registerGauge("process_threads", threading.active_count)
@@ -0,0 +1,84 @@
+from .logging import logger
+from typing import Callable, Optional
+import heapq
+import itertools
+import threading
+import time
+
+class ScheduledTask:
+
+	__slots__ = ("scheduler", "dueAt", "callback", "cancelled")
+
+	def __init__(self, scheduler: "Scheduler", dueAt: float, callback: Callable[[], None]) -> None:
+		self.scheduler = scheduler
+		self.dueAt = dueAt
+		self.callback = callback
+		self.cancelled = False
+
+	def cancel(self) -> None:
+		self.scheduler.cancel(self)
+
+class Scheduler:
+
+	compactionThreshold = 64
+
+	def __init__(self, name: str = "Scheduler") -> None:
+		self.name = name
+		self.queue: list[tuple[float, int, ScheduledTask]] = []
+		self.sequence = itertools.count()
+		self.cancelledCount = 0
+		self.condition = threading.Condition()
+		self.thread: Optional[threading.Thread] = None
+
+	def schedule(self, delay: float, callback: Callable[[], None]) -> ScheduledTask:
+		task = ScheduledTask(self, time.monotonic() + delay, callback)
+		with self.condition:
+			heapq.heappush(self.queue, (task.dueAt, next(self.sequence), task))
+			if not self.thread:
+				self.thread = threading.Thread(target = self.run, name = self.name, daemon = True)
+				self.thread.start()
+			if self.queue[0][2] is task:
+				self.condition.notify()
+		return task
+
+	def reschedule(self, task: Optional[ScheduledTask], delay: float, callback: Callable[[], None]) -> ScheduledTask:
+		if task:
+			task.cancel()
+		return self.schedule(delay, callback)
+
+	def cancel(self, task: ScheduledTask) -> None:
+		with self.condition:
+			if task.cancelled:
+				return
+			task.cancelled = True
+			self.cancelledCount += 1
+			if self.cancelledCount > self.compactionThreshold and self.cancelledCount > len(self.queue) // 2:
+				self.queue = [entry for entry in self.queue if not entry[2].cancelled]
+				heapq.heapify(self.queue)
+				self.cancelledCount = 0
+
+	def popDueTask(self) -> ScheduledTask:
+		with self.condition:
+			while True:
+				while self.queue and self.queue[0][2].cancelled:
+					heapq.heappop(self.queue)
+					self.cancelledCount -= 1
+				if not self.queue:
+					self.condition.wait()
+					continue
+				timeout = self.queue[0][0] - time.monotonic()
+				if timeout <= 0:
+					task = heapq.heappop(self.queue)[2]
+					task.cancelled = True
+					return task
+				self.condition.wait(timeout)
+
+	def run(self) -> None:
+		while True:
+			task = self.popDueTask()
+			try:
+				task.callback()
+			except:
+				logger.exception("An unexpected error occured in a scheduled task")
+
+scheduler = Scheduler()
@@ -0,0 +1,47 @@
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+import threading
+import time
+
+T = TypeVar("T")
+
+class SingleFlight(Generic[T]):
+
+	def __init__(self, failureTtl: float = 0) -> None:
+		self.failureTtl = failureTtl
+		self.calls: dict[Hashable, Future[Optional[T]]] = {}
+		self.failures: dict[Hashable, float] = {}
+		self.lock = threading.Lock()
+
+	def submit(self, key: Hashable, executor: Executor, func: Callable[..., Optional[T]], *args: Any) -> Future[Optional[T]]:
+		with self.lock:
+			failedUntil = self.failures.get(key)
+			if failedUntil is not None:
+				if failedUntil > time.monotonic():
+					failedFuture: Future[Optional[T]] = Future()
+					failedFuture.set_result(None)
+					return failedFuture
+				del self.failures[key]
+			inFlightFuture = self.calls.get(key)
+			if inFlightFuture:
+				return inFlightFuture
+			future: Future[Optional[T]] = Future()
+			self.calls[key] = future
+		executor.submit(self.run, key, future, func, *args)
+		return future
+
+	def run(self, key: Hashable, future: Future[Optional[T]], func: Callable[..., Optional[T]], *args: Any) -> None:
+		result: Optional[T] = None
+		exception: Optional[BaseException] = None
+		try:
+			result = func(*args)
+		except BaseException as e:
+			exception = e
+		with self.lock:
+			del self.calls[key]
+			if not result and self.failureTtl > 0:
+				self.failures[key] = time.monotonic() + self.failureTtl
+		if exception:
+			future.set_exception(exception)
+		else:
+			future.set_result(result)
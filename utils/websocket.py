@@ -0,0 +1,117 @@
+from typing import Optional
+import asyncio
+import base64
+import hashlib
+import os
+import ssl
+import struct
+import time
+import urllib.parse
+
+class WebSocketOpcode:
+	CONTINUATION = 0x0
+	TEXT = 0x1
+	BINARY = 0x2
+	CLOSE = 0x8
+	PING = 0x9
+	PONG = 0xA
+
+class WebSocketConnection:
+
+	acceptGuid = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+	def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		self.reader = reader
+		self.writer = writer
+		self.closed = False
+		self.lastReceivedAt = time.monotonic()
+
+	async def readFrame(self) -> tuple[bool, int, bytes]:
+		header = await self.reader.readexactly(2)
+		fin, opcode = bool(header[0] & 0x80), header[0] & 0x0F
+		masked, length = bool(header[1] & 0x80), header[1] & 0x7F
+		if length == 126:
+			length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+		elif length == 127:
+			length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+		mask = await self.reader.readexactly(4) if masked else b""
+		payload = await self.reader.readexactly(length)
+		if mask:
+			payload = self.applyMask(payload, mask)
+		self.lastReceivedAt = time.monotonic()
+		return fin, opcode, payload
+
+	def applyMask(self, payload: bytes, mask: bytes) -> bytes:
+		repeatedMask = (mask * (len(payload) // 4 + 1))[:len(payload)]
+		return (int.from_bytes(payload, "big") ^ int.from_bytes(repeatedMask, "big")).to_bytes(len(payload), "big")
+
+	async def sendFrame(self, opcode: int, payload: bytes = b"") -> None:
+		length = len(payload)
+		if length < 126:
+			header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+		elif length < 65536:
+			header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+		else:
+			header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+		mask = os.urandom(4)
+		self.writer.write(header + mask + self.applyMask(payload, mask))
+		await self.writer.drain()
+
+	async def recv(self) -> str:
+		fragments: list[bytes] = []
+		while True:
+			fin, opcode, payload = await self.readFrame()
+			if opcode == WebSocketOpcode.PING:
+				await self.sendFrame(WebSocketOpcode.PONG, payload)
+			elif opcode == WebSocketOpcode.CLOSE:
+				await self.close()
+				raise ConnectionError("WebSocket closed by server")
+			elif opcode in [WebSocketOpcode.TEXT, WebSocketOpcode.BINARY, WebSocketOpcode.CONTINUATION]:
+				fragments.append(payload)
+				if fin:
+					return b"".join(fragments).decode("utf-8")
+
+	async def ping(self) -> None:
+		await self.sendFrame(WebSocketOpcode.PING)
+
+	async def close(self) -> None:
+		if self.closed:
+			return
+		self.closed = True
+		try:
+			await self.sendFrame(WebSocketOpcode.CLOSE, struct.pack("!H", 1000))
+		except:
+			pass
+		self.writer.close()
+
+async def connectWebSocket(url: str, timeout: Optional[float] = 10) -> WebSocketConnection:
+	parsedUrl = urllib.parse.urlsplit(url)
+	isSecure = parsedUrl.scheme == "wss"
+	host = parsedUrl.hostname or ""
+	port = parsedUrl.port or (443 if isSecure else 80)
+	reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl = ssl.create_default_context() if isSecure else None), timeout)
+	key = base64.b64encode(os.urandom(16)).decode("ascii")
+	path = parsedUrl.path or "/"
+	if parsedUrl.query:
+		path += f"?{parsedUrl.query}"
+	writer.write((
+		f"GET {path} HTTP/1.1\r\n"
+		f"Host: {parsedUrl.netloc}\r\n"
+		"Upgrade: websocket\r\n"
+		"Connection: Upgrade\r\n"
+		f"Sec-WebSocket-Key: {key}\r\n"
+		"Sec-WebSocket-Version: 13\r\n"
+		"\r\n"
+	).encode("ascii"))
+	await writer.drain()
+	responseLines = (await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)).decode("latin-1").split("\r\n")
+	statusLine = responseLines[0].split(" ", 2)
+	if len(statusLine) < 2 or statusLine[1] != "101":
+		writer.close()
+		raise ConnectionError(f"WebSocket handshake failed: {responseLines[0]}")
+	headers = { name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in responseLines[1:] if line) }
+	expectedAccept = base64.b64encode(hashlib.sha1((key + WebSocketConnection.acceptGuid).encode("ascii")).digest()).decode("ascii")
+	if headers.get("sec-websocket-accept") != expectedAccept:
+		writer.close()
+		raise ConnectionError("WebSocket handshake failed: invalid Sec-WebSocket-Accept header")
+	return WebSocketConnection(reader, writer)